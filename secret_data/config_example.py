@@ -5,3 +5,39 @@ DB_PASSWORD = "123456"
 SECRET_KEY = "some key"  # Секретный ключ для подписи JWT токенов
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 6  # Токен будет работать 6 часов
+
+# Количество hash-секций для таблиц tasks (по owner_id) и task_permissions (по user_id).
+# 0 - без секционирования. Применяется только при создании таблиц
+TASK_PARTITIONS = 0
+
+# Запуск через python -m source.server
+SERVER_HOST = "127.0.0.35"
+SERVER_PORT = 8000
+SERVER_WORKERS = 4
+# Пул соединений с БД на каждый процесс
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+
+# Кэш задач для /tasks/read/{task_id}
+TASK_CACHE_SIZE = 10_000
+TASK_CACHE_TTL = 30  # Секунды
+REDIS_URL = None  # Например "redis://localhost:6379/0" - общий кэш для всех процессов (нужен пакет redis)
+
+# Токен для служебных endpoint /admin/... (заголовок X-Admin-Token). None - доступ закрыт
+ADMIN_TOKEN = None
+
+# Фоновые задачи: исполнителей на процесс, период опроса очереди (с), через сколько секунд
+# без отметок о ходе выполнения задача считается зависшей и забирается заново
+JOB_CONCURRENCY = 2
+JOB_POLL_INTERVAL = 1.0
+JOB_STALE_SECONDS = 300
+
+# Длинные описания задач: сколько символов показывается в списках (остальное - в task_bodies)
+# и до какого размера (байт) полное описание хранится в кэше /tasks/read/{task_id}
+DESCRIPTION_PREVIEW_LENGTH = 500
+TASK_CACHE_MAX_DESCRIPTION = 4 * 1024
+# Общий размер записей кэша задач в каждом процессе (байт)
+TASK_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Ответы больше этого размера (байт) сжимаются: zstd/br (если установлены zstandard/brotli) или gzip
+COMPRESSION_MIN_SIZE = 1024
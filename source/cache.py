@@ -0,0 +1,222 @@
+"""
+Кэш задач для /tasks/read/{task_id}: строка задачи и права пользователей на неё (права корневой задачи дерева).
+
+Два уровня:
+    - LRU с TTL в памяти процесса, ограниченный числом записей и их общим размером (TASK_CACHE_MAX_BYTES)
+    - общий для всех процессов кэш в Redis (если задан REDIS_URL и установлен пакет redis)
+
+Изменения задач и прав инвалидируют запись явно (crud/user_tasks.py), а через
+PostgreSQL NOTIFY инвалидация после коммита доходит до всех процессов.
+Соединение слушателя переподключается при потере (source/notify.py); уведомления, пропущенные
+без соединения, не восстановить, поэтому после переподключения локальный кэш сбрасывается целиком.
+
+Чтение, не нашедшее запись, берёт generation до запроса к БД и передаёт его в set: если за время
+запроса в процессе была инвалидация (любой задачи), прочитанная строка могла устареть и в кэш не пишется.
+Иначе запрос, начатый до коммита изменения и завершившийся после инвалидации, вернул бы в кэш
+старую запись до истечения TTL. Запись в Redis, сделанная другим процессом до получения им NOTIFY,
+удаляется, когда NOTIFY до него доходит (invalidate сбрасывает оба уровня).
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
+from source.notify import NotifyListener
+from secret_data import config
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+
+TASK_CACHE_SIZE = getattr(config, "TASK_CACHE_SIZE", 10_000)
+TASK_CACHE_TTL = getattr(config, "TASK_CACHE_TTL", 30)
+# Общий размер записей локального кэша (байт JSON) в каждом процессе
+TASK_CACHE_MAX_BYTES = getattr(config, "TASK_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+# Более длинные описания (байт UTF-8) не кэшируются, в записи остаётся превью
+TASK_CACHE_MAX_DESCRIPTION = getattr(config, "TASK_CACHE_MAX_DESCRIPTION", 4 * 1024)
+REDIS_URL = getattr(config, "REDIS_URL", None)
+
+INVALIDATION_CHANNEL = "task_cache_invalidate"
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением по количеству записей, их общему размеру (maxbytes, размер записи
+    передаётся в set) и времени жизни записи
+    """
+
+    def __init__(self, maxsize: int, ttl: float, maxbytes: int | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expires_at, value, size = item
+        if expires_at < time.monotonic():
+            self.delete(key)
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key):
+        """
+        Как get, но без обновления порядка LRU
+        """
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def set(self, key, value, size: int = 0):
+        self.delete(key)
+        self._data[key] = (time.monotonic() + self.ttl, value, size)
+        self.bytes += size
+
+        while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.bytes -= evicted_size
+
+    def delete(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[2]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+
+class TaskCache:
+    """
+    Запись кэша - dict {"task": {...}, "permissions": {user_id: [can_read, can_update]}}
+    (ключи permissions - строки, чтобы запись одинаково выглядела после JSON в Redis)
+    """
+
+    def __init__(self, maxsize: int = TASK_CACHE_SIZE, ttl: float = TASK_CACHE_TTL, redis_url: str | None = REDIS_URL,
+                 maxbytes: int = TASK_CACHE_MAX_BYTES):
+        self.local = TTLCache(maxsize, ttl, maxbytes)
+        self.ttl = ttl
+        self.shared = redis.from_url(redis_url) if redis_url and redis is not None else None
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Счётчик локальных инвалидаций, см. set
+        self.generation = 0
+
+        self._listener = NotifyListener({INVALIDATION_CHANNEL: self._on_notification},
+                                        on_reconnect=self._on_listener_reconnect)
+        self._pending = set()
+
+    @staticmethod
+    def _shared_key(task_id: int):
+        return f"task:{task_id}"
+
+    async def get(self, task_id: int):
+        entry = self.local.get(task_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        if self.shared is not None:
+            raw_entry = await self.shared.get(self._shared_key(task_id))
+            if raw_entry is not None:
+                entry = json.loads(raw_entry)
+                self.local.set(task_id, entry, len(raw_entry))
+                self.hits += 1
+                self.shared_hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def peek_owner_id(self, task_id: int):
+        """
+        Владелец задачи из локальной записи (None - записи нет). Без обращения к Redis и без учёта
+        в статистике попаданий: статистика относится к /tasks/read/{task_id}
+        """
+        entry = self.local.peek(task_id)
+        return entry["task"]["owner_id"] if entry is not None else None
+
+    async def set(self, task_id: int, entry: dict, generation: int | None = None):
+        """
+        generation - значение self.generation, взятое до чтения entry из БД.
+        Если с тех пор была инвалидация, запись не сохраняется (возвращает False)
+        """
+        if generation is not None and generation != self.generation:
+            return False
+
+        raw_entry = json.dumps(entry)
+        self.local.set(task_id, entry, len(raw_entry))
+
+        if self.shared is not None:
+            await self.shared.set(self._shared_key(task_id), raw_entry, ex=self.ttl)
+        return True
+
+    async def invalidate(self, task_id: int):
+        self.invalidations += 1
+        self.generation += 1
+        self.local.delete(task_id)
+
+        if self.shared is not None:
+            await self.shared.delete(self._shared_key(task_id))
+
+    @staticmethod
+    async def notify_invalidation(db: AsyncSession, task_ids: list[int]):
+        """
+        NOTIFY в текущей транзакции: остальные процессы получат его только после коммита
+        """
+        await db.execute(text("SELECT pg_notify(:channel, task_id::text) FROM unnest(CAST(:task_ids AS integer[])) "
+                              "AS task_id"),
+                         {"channel": INVALIDATION_CHANNEL, "task_ids": list(task_ids)})
+
+    def _on_notification(self, payload):
+        task = asyncio.get_running_loop().create_task(self.invalidate(int(payload)))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def _on_listener_reconnect(self):
+        # Пропущенные инвалидации неизвестны: сбрасываются все записи и чтения, начатые до переподключения
+        self.generation += 1
+        self.local.clear()
+
+    async def start_listener(self, engine: AsyncEngine):
+        """
+        LISTEN на отдельном соединении из пула engine, которое держится открытым до stop_listener
+        """
+        await self._listener.start(engine)
+
+    async def stop_listener(self):
+        await self._listener.stop()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "invalidations": self.invalidations,
+            "size": len(self.local),
+            "bytes": self.local.bytes,
+            "shared": self.shared is not None,
+            "listener_connected": self._listener.connected,
+            "listener_reconnects": self._listener.reconnects,
+        }
+
+
+task_cache = TaskCache()
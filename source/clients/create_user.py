@@ -1,5 +1,5 @@
-import httpx
 import asyncio
+from source.clients.todo_client import AsyncTodoClient
 
 
 TEST_USERNAME = "testuser"
@@ -7,11 +7,8 @@ TEST_PASSWORD = "testpass"
 
 
 async def main():
-    async with httpx.AsyncClient() as client:
-        response = await client.post("http://127.0.0.35:8000/users/create", json={"username": TEST_USERNAME,
-                                                                                  "password": TEST_PASSWORD})
-
-        print(response.status_code, response.json())
+    async with AsyncTodoClient("http://127.0.0.35:8000", TEST_USERNAME, TEST_PASSWORD) as client:
+        print(await client.create_user())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,4 @@
+from source.clients.todo_client.client import AsyncTodoClient, ApiError
+from source.clients.todo_client.sync_client import TodoClient
+
+__all__ = ["AsyncTodoClient", "TodoClient", "ApiError"]
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import random
+import time
+from typing import AsyncIterator, Iterable, TextIO
+import httpx
+from source.schemas import schemas
+
+
+DEFAULT_BASE_URL = "http://127.0.0.35:8000"
+
+# Коды ответа, при которых запрос можно безопасно повторить
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class AsyncTodoClient:
+    """
+    Асинхронный клиент ToDo List API.
+
+    Держит пул keep-alive соединений, кэширует токен и обновляет его до истечения срока,
+    повторяет запросы при сетевых ошибках и 429/5xx с экспоненциальной задержкой и jitter.
+
+        async with AsyncTodoClient(username="user", password="pass") as client:
+            task = await client.create_task("Title", "Description")
+            async for task in client.iter_tasks():
+                ...
+    """
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, username: str | None = None, password: str | None = None,
+                 *, timeout: float = 10.0, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 retries: int = 3, backoff: float = 0.2, token_refresh_margin: float = 60.0,
+                 transport: httpx.AsyncBaseTransport | None = None):
+        self.username = username
+        self.password = password
+        self.retries = retries
+        self.backoff = backoff
+        self.token_refresh_margin = token_refresh_margin
+
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections),
+            transport=transport,
+        )
+        self._token: str | None = None
+        self._token_expires_at = 0.0
+        # Токен, полученный принудительно после 403 (см. _request)
+        self._forced_token: str | None = None
+        self._token_lock = asyncio.Lock()
+        self._user: schemas.MoreUserInfo | None = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def _send(self, method: str, path: str, *, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """
+        Отправляет запрос с повторами. Неидемпотентные запросы повторяются, только если
+        соединение не было установлено (запрос гарантированно не дошёл до сервера)
+        """
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+
+            try:
+                response = await self._http.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if last_attempt:
+                    raise
+            except httpx.TransportError:
+                if last_attempt or not idempotent:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt or not idempotent:
+                    return response
+
+            # Full jitter: случайная задержка от 0 до backoff * 2^attempt
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        if response.status_code < 400:
+            return
+
+        try:
+            message = response.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = response.text
+        raise ApiError(response.status_code, message)
+
+    async def _get_token(self, rejected_token: str | None = None) -> str:
+        """
+        rejected_token - токен, на который сервер ответил 403: он заменяется новым, если его
+        ещё не заменил параллельный запрос
+        """
+        async with self._token_lock:
+            forced = rejected_token is not None and rejected_token == self._token
+            if forced or not self._token or time.monotonic() >= self._token_expires_at:
+                token = await self.get_token()
+                self._token = token.access_token
+                self._token_expires_at = time.monotonic() + token.expire_minutes * 60 - self.token_refresh_margin
+                if forced:
+                    self._forced_token = self._token
+            return self._token
+
+    async def _request(self, path: str, *, json_data=None, params: dict | None = None, idempotent: bool = True):
+        """
+        Запрос от имени пользователя: добавляет токен и при 403 один раз получает новый токен и повторяет запрос.
+
+        Срок токена известен по кэшу, но 403 возвращается и при нехватке прав на задачу, а токен может
+        быть отозван раньше срока. Поэтому токен, полученный принудительно после 403, больше не обновляется
+        до истечения срока: 403 с ним - нехватка прав, и get_token вызывается не чаще раза за срок токена
+        """
+        params = dict(params or {})
+
+        for refreshed in (False, True):
+            token = await self._get_token(rejected_token=token if refreshed else None)
+            response = await self._send("POST", path, json=json_data, params={**params, "token": token},
+                                        idempotent=idempotent)
+
+            if response.status_code == 403 and not refreshed and token != self._forced_token:
+                continue
+
+            self._raise_for_status(response)
+            return response.json()
+
+    # Пользователи
+
+    async def create_user(self, username: str | None = None, password: str | None = None) -> schemas.User:
+        user = schemas.UserCreate(username=username or self.username, password=password or self.password)
+        response = await self._send("POST", "/users/create", json=user.model_dump(), idempotent=False)
+        self._raise_for_status(response)
+        return schemas.User.model_validate(response.json())
+
+    async def get_token(self) -> schemas.Token:
+        user = schemas.UserCreate(username=self.username, password=self.password)
+        response = await self._send("POST", "/users/get_token", json=user.model_dump())
+        self._raise_for_status(response)
+        return schemas.Token.model_validate(response.json())
+
+    async def me(self, refresh: bool = False) -> schemas.MoreUserInfo:
+        if self._user is None or refresh:
+            self._user = schemas.MoreUserInfo.model_validate(await self._request("/users/check_token_auth"))
+        return self._user
+
+    # Задачи
+
+    async def create_task(self, title: str, description: str) -> schemas.Task:
+        owner_id = (await self.me()).id
+        task = schemas.TaskCreate(title=title, description=description, owner_id=owner_id)
+        return schemas.Task.model_validate(await self._request("/tasks/create", json_data=task.model_dump(),
+                                                               idempotent=False))
+
+    async def read_task(self, task_id: int) -> schemas.Task:
+        return schemas.Task.model_validate(await self._request(f"/tasks/read/{task_id}"))
+
+    async def read_tasks(self, skip: int = 0, limit: int = 10) -> list[schemas.Task]:
+        params = schemas.ReadTaskParams(skip=skip, limit=limit)
+        tasks = await self._request("/tasks/read_tasks", json_data=params.model_dump())
+        return [schemas.Task.model_validate(task) for task in tasks]
+
+    async def update_task(self, task_id: int, title: str, description: str) -> schemas.Task:
+        task = schemas.TaskBase(title=title, description=description)
+        return schemas.Task.model_validate(await self._request(f"/tasks/update/{task_id}",
+                                                               json_data=task.model_dump()))
+
+    async def delete_task(self, task_id: int) -> None:
+        await self._request(f"/tasks/delete/{task_id}")
+
+    async def update_task_permissions(self, task_id: int, user_id: int, can_read: bool | None = None,
+                                      can_update: bool | None = None) -> schemas.TaskPermission:
+        permission = schemas.TaskPermissionUpdate(user_id=user_id, can_read=can_read, can_update=can_update)
+        return schemas.TaskPermission.model_validate(await self._request(f"/tasks/update_permissions/{task_id}",
+                                                                         json_data=permission.model_dump()))
+
+    # Массовые операции
+
+    async def _gather_limited(self, coroutines, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
+
+    async def bulk_create_tasks(self, tasks: Iterable[schemas.TaskBase], concurrency: int = 10) -> list[schemas.Task]:
+        """
+        Создаёт задачи параллельно (не больше concurrency запросов одновременно), порядок результата совпадает с tasks
+        """
+        await self.me()
+        return await self._gather_limited((self.create_task(task.title, task.description) for task in tasks),
+                                          concurrency)
+
+    async def bulk_share(self, task_ids: Iterable[int], user_ids: Iterable[int], can_read: bool | None = True,
+                         can_update: bool | None = None, concurrency: int = 10) -> list[schemas.TaskPermission]:
+        """
+        Выдаёт права на каждую задачу из task_ids каждому пользователю из user_ids
+        """
+        user_ids = list(user_ids)
+        return await self._gather_limited(
+            (self.update_task_permissions(task_id, user_id, can_read=can_read, can_update=can_update)
+             for task_id in task_ids for user_id in user_ids),
+            concurrency
+        )
+
+    async def iter_tasks(self, page_size: int = 100) -> AsyncIterator[schemas.Task]:
+        """
+        Постранично перебирает все доступные пользователю задачи
+        """
+        skip = 0
+        while True:
+            page = await self.read_tasks(skip=skip, limit=page_size)
+            for task in page:
+                yield task
+
+            if len(page) < page_size:
+                return
+            skip += page_size
+
+    async def export_tasks(self, file: TextIO, page_size: int = 100) -> int:
+        """
+        Записывает все доступные задачи в file в формате JSON Lines, возвращает количество задач
+        """
+        count = 0
+        async for task in self.iter_tasks(page_size=page_size):
+            file.write(json.dumps(task.model_dump(mode="json"), ensure_ascii=False) + "\n")
+            count += 1
+        return count
@@ -0,0 +1,80 @@
+import asyncio
+from typing import Iterable, Iterator, TextIO
+from source.clients.todo_client.client import AsyncTodoClient
+from source.schemas import schemas
+
+
+class TodoClient:
+    """
+    Синхронная обёртка над AsyncTodoClient. Использует собственный event loop,
+    поэтому её нельзя вызывать из уже работающего event loop
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._client = self._run(self._create_client(*args, **kwargs))
+
+    @staticmethod
+    async def _create_client(*args, **kwargs):
+        # httpx.AsyncClient должен создаваться внутри того loop, в котором будет работать
+        return AsyncTodoClient(*args, **kwargs)
+
+    def _run(self, coroutine):
+        return self._loop.run_until_complete(coroutine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if not self._loop.is_closed():
+            self._run(self._client.close())
+            self._loop.close()
+
+    def create_user(self, username: str | None = None, password: str | None = None) -> schemas.User:
+        return self._run(self._client.create_user(username, password))
+
+    def get_token(self) -> schemas.Token:
+        return self._run(self._client.get_token())
+
+    def me(self, refresh: bool = False) -> schemas.MoreUserInfo:
+        return self._run(self._client.me(refresh))
+
+    def create_task(self, title: str, description: str) -> schemas.Task:
+        return self._run(self._client.create_task(title, description))
+
+    def read_task(self, task_id: int) -> schemas.Task:
+        return self._run(self._client.read_task(task_id))
+
+    def read_tasks(self, skip: int = 0, limit: int = 10) -> list[schemas.Task]:
+        return self._run(self._client.read_tasks(skip, limit))
+
+    def update_task(self, task_id: int, title: str, description: str) -> schemas.Task:
+        return self._run(self._client.update_task(task_id, title, description))
+
+    def delete_task(self, task_id: int) -> None:
+        return self._run(self._client.delete_task(task_id))
+
+    def update_task_permissions(self, task_id: int, user_id: int, can_read: bool | None = None,
+                                can_update: bool | None = None) -> schemas.TaskPermission:
+        return self._run(self._client.update_task_permissions(task_id, user_id, can_read, can_update))
+
+    def bulk_create_tasks(self, tasks: Iterable[schemas.TaskBase], concurrency: int = 10) -> list[schemas.Task]:
+        return self._run(self._client.bulk_create_tasks(tasks, concurrency))
+
+    def bulk_share(self, task_ids: Iterable[int], user_ids: Iterable[int], can_read: bool | None = True,
+                   can_update: bool | None = None, concurrency: int = 10) -> list[schemas.TaskPermission]:
+        return self._run(self._client.bulk_share(task_ids, user_ids, can_read, can_update, concurrency))
+
+    def iter_tasks(self, page_size: int = 100) -> Iterator[schemas.Task]:
+        iterator = self._client.iter_tasks(page_size).__aiter__()
+        while True:
+            try:
+                yield self._run(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+
+    def export_tasks(self, file: TextIO, page_size: int = 100) -> int:
+        return self._run(self._client.export_tasks(file, page_size))
@@ -0,0 +1,175 @@
+"""
+Сжатие ответов (ASGI middleware) по заголовку Accept-Encoding: zstd, br, gzip.
+
+zstd и br доступны, если установлены пакеты zstandard и brotli, gzip - всегда.
+Ответы меньше COMPRESSION_MIN_SIZE байт, уже сжатые и с несжимаемым Content-Type отправляются как есть.
+Потоковые ответы (StreamingResponse) сжимаются по мере отправки, без Content-Length.
+"""
+import zlib
+from secret_data import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_MIN_SIZE = getattr(config, "COMPRESSION_MIN_SIZE", 1024)
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+class GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=4)
+
+    def compress(self, data: bytes):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data: bytes):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+# В порядке предпочтения сервера при одинаковом q
+COMPRESSORS = {
+    name: compressor for name, compressor, available in [
+        ("zstd", ZstdCompressor, zstandard is not None),
+        ("br", BrotliCompressor, brotli is not None),
+        ("gzip", GzipCompressor, True),
+    ] if available
+}
+
+
+def choose_encoding(accept_encoding: str):
+    """
+    Лучшее из доступных сжатий для Accept-Encoding (None - отправлять без сжатия)
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for name in COMPRESSORS:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            if start_message is not None:
+                # Первая часть тела: решаем, сжимать ли ответ
+                start, start_message = start_message, None
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+
+                if not self._compressible(start):
+                    await send(start)
+                    await send(message)
+                    return
+
+                if not more_body and len(body) < self.min_size:
+                    await send({**start, "headers": [*start["headers"], (b"vary", b"Accept-Encoding")]})
+                    await send(message)
+                    return
+
+                compressor = COMPRESSORS[encoding]()
+                response_headers = [(name, value) for name, value in start["headers"]
+                                    if name.lower() != b"content-length"]
+                response_headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+
+                compressed = compressor.compress(body)
+                if not more_body:
+                    compressed += compressor.flush()
+                    response_headers.append((b"content-length", str(len(compressed)).encode()))
+
+                await send({**start, "headers": response_headers})
+                await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+                return
+
+            if compressor is None:
+                await send(message)
+                return
+
+            more_body = message.get("more_body", False)
+            compressed = compressor.compress(message.get("body", b""))
+            if not more_body:
+                compressed += compressor.flush()
+            await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressible(start_message):
+        if start_message["status"] in (204, 304):
+            return False
+
+        headers = {name.lower(): value for name, value in start_message["headers"]}
+        if b"content-encoding" in headers:
+            return False
+
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
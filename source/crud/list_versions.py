@@ -0,0 +1,64 @@
+"""
+Счётчики изменений списков пользователей (user_list_versions) для ETag /tasks/read_tasks и /users/check_token_auth.
+
+Счётчик увеличивается у всех, чьи ответы могло изменить действие с задачами:
+у владельцев задач, у тех, кому задачи видны (user_visible_tasks), и у тех, у кого есть права на них.
+Счётчик только растёт, поэтому старый ETag никогда не совпадёт с изменившимся списком.
+"""
+from sqlalchemy import union
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from source.models import models
+
+
+def _on_conflict_bump(statement):
+    return statement.on_conflict_do_update(
+        index_elements=[models.UserListVersion.user_id],
+        set_={"version": models.UserListVersion.version + 1}
+    )
+
+
+async def bump_users(db: AsyncSession, user_ids: list[int]):
+    """
+    Увеличивает счётчики пользователей (без коммита)
+    """
+    user_ids = sorted(set(user_ids))  # Один порядок блокировок строк во всех транзакциях
+    if not user_ids:
+        return
+
+    await db.execute(_on_conflict_bump(insert(models.UserListVersion).values([
+        {"user_id": user_id} for user_id in user_ids
+    ])))
+
+
+async def bump_task_users(db: AsyncSession, task_ids: list[int]):
+    """
+    Увеличивает счётчики всех, кого касаются задачи task_ids. Вызывается до удаления прав и строк
+    user_visible_tasks, иначе тех, кто видел задачу, уже не найти
+    """
+    if not task_ids:
+        return
+
+    user_ids = union(
+        select(models.Task.owner_id.label("user_id")).filter(models.Task.id.in_(task_ids)),
+        select(models.UserVisibleTask.user_id).filter(models.UserVisibleTask.task_id.in_(task_ids)),
+        select(models.TaskPermission.user_id).filter(models.TaskPermission.task_id.in_(task_ids)),
+    ).subquery()
+
+    await db.execute(_on_conflict_bump(insert(models.UserListVersion).from_select(
+        ["user_id"], select(user_ids.c.user_id).filter(user_ids.c.user_id.is_not(None)).order_by(user_ids.c.user_id)
+    )))
+
+
+async def get_version_by_username(db: AsyncSession, username: str):
+    """
+    (user_id, счётчик) одним запросом по уникальному индексу users.username, None - пользователя нет
+    """
+    result = await db.execute(
+        select(models.User.id, models.UserListVersion.version)
+        .outerjoin(models.UserListVersion, models.UserListVersion.user_id == models.User.id)
+        .filter(models.User.username == username)
+    )
+    row = result.first()
+    return (row.id, row.version or 0) if row else None
@@ -0,0 +1,105 @@
+"""
+Длинные описания задач.
+
+В tasks.description хранится только превью (первые DESCRIPTION_PREVIEW_LENGTH символов) и флаг
+description_truncated, полный текст - в task_bodies частями по BODY_CHUNK_SIZE байт UTF-8, сжатыми zlib.
+Списки задач и загрузка пользователя со всеми его задачами читают только превью.
+
+Функции не коммитят. Миграция m0007 переносит описания своей копией этого формата и от модуля не зависит.
+"""
+import zlib
+from sqlalchemy import delete, insert, func
+from sqlalchemy.future import select
+from source.models import models
+from secret_data import config
+
+
+DESCRIPTION_PREVIEW_LENGTH = getattr(config, "DESCRIPTION_PREVIEW_LENGTH", 500)
+BODY_CHUNK_SIZE = 64 * 1024
+COMPRESSION_LEVEL = 6
+
+
+def split_description(description: str):
+    """
+    Возвращает (превью, обрезано ли описание)
+    """
+    if len(description) <= DESCRIPTION_PREVIEW_LENGTH:
+        return description, False
+    return description[:DESCRIPTION_PREVIEW_LENGTH], True
+
+
+async def set_body(db, task_id: int, description: str):
+    """
+    Заменяет полный текст описания задачи. У короткого описания (целиком в tasks.description) строк нет
+    """
+    await db.execute(delete(models.TaskBody).filter(models.TaskBody.task_id == task_id))
+
+    if len(description) <= DESCRIPTION_PREVIEW_LENGTH:
+        return
+
+    raw = description.encode()
+    await db.execute(insert(models.TaskBody), [
+        {
+            "task_id": task_id,
+            "chunk_no": chunk_no,
+            "size": len(raw[start:start + BODY_CHUNK_SIZE]),
+            "data": zlib.compress(raw[start:start + BODY_CHUNK_SIZE], COMPRESSION_LEVEL),
+        }
+        for chunk_no, start in enumerate(range(0, len(raw), BODY_CHUNK_SIZE))
+    ])
+
+
+async def delete_bodies(db, task_ids: list[int]):
+    await db.execute(delete(models.TaskBody).filter(models.TaskBody.task_id.in_(task_ids)))
+
+
+async def get_body_size(db, task_id: int):
+    """
+    Размер полного описания в байтах UTF-8 (0, если оно целиком в tasks.description)
+    """
+    result = await db.execute(select(func.coalesce(func.sum(models.TaskBody.size), 0))
+                              .filter(models.TaskBody.task_id == task_id))
+    return result.scalar_one()
+
+
+async def get_description(db, task_id: int):
+    result = await db.execute(select(models.TaskBody.data).filter(models.TaskBody.task_id == task_id)
+                              .order_by(models.TaskBody.chunk_no))
+    return b"".join(zlib.decompress(data) for data in result.scalars()).decode()
+
+
+async def get_description_range(db, task_id: int, offset: int = 0, length: int | None = None):
+    """
+    Байты [offset, offset + length) полного описания задачи.
+    Возвращает (размер описания, размер диапазона, итератор частей): из БД читаются только
+    сжатые части, попавшие в диапазон, а распаковываются они по одной при чтении итератора
+    """
+    result = await db.execute(select(models.Task.description, models.Task.description_truncated)
+                              .filter(models.Task.id == task_id))
+    description, truncated = result.one()
+
+    if not truncated:
+        raw = description.encode()
+        end = len(raw) if length is None else min(offset + length, len(raw))
+        return len(raw), max(end - offset, 0), iter([raw[offset:end]])
+
+    total = await get_body_size(db, task_id)
+    end = total if length is None else min(offset + length, total)
+
+    if offset >= end:
+        return total, 0, iter(())
+
+    result = await db.execute(
+        select(models.TaskBody.chunk_no, models.TaskBody.data)
+        .filter(models.TaskBody.task_id == task_id,
+                models.TaskBody.chunk_no.between(offset // BODY_CHUNK_SIZE, (end - 1) // BODY_CHUNK_SIZE))
+        .order_by(models.TaskBody.chunk_no)
+    )
+    chunks = result.all()
+
+    def iter_range():
+        for chunk_no, data in chunks:
+            chunk_start = chunk_no * BODY_CHUNK_SIZE
+            yield zlib.decompress(data)[max(offset - chunk_start, 0):end - chunk_start]
+
+    return total, end - offset, iter_range()
@@ -0,0 +1,83 @@
+from collections import Counter
+from sqlalchemy import text
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from source.models import models
+
+
+# Ожидаемые значения счётчиков, вычисленные по user_visible_tasks
+EXPECTED_COUNTERS_SQL = """
+    SELECT v.user_id,
+           count(*) FILTER (WHERE v.owner_id = v.user_id) AS owned,
+           count(*) FILTER (WHERE v.owner_id <> v.user_id) AS shared
+    FROM user_visible_tasks v
+    GROUP BY v.user_id
+"""
+
+
+async def adjust_counters(db: AsyncSession, owned: Counter = None, shared: Counter = None):
+    """
+    Прибавляет к счётчикам пользователей изменения {user_id: delta} одним запросом (без коммита)
+    """
+    owned, shared = owned or Counter(), shared or Counter()
+    user_ids = sorted(set(owned) | set(shared))  # Один порядок блокировок строк во всех транзакциях
+
+    if not user_ids:
+        return
+
+    statement = insert(models.UserTaskCounters).values([
+        {"user_id": user_id, "owned": owned[user_id], "shared": shared[user_id]} for user_id in user_ids
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[models.UserTaskCounters.user_id],
+        set_={
+            "owned": models.UserTaskCounters.owned + statement.excluded.owned,
+            "shared": models.UserTaskCounters.shared + statement.excluded.shared,
+        }
+    ))
+
+
+async def get_counters(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.UserTaskCounters.owned, models.UserTaskCounters.shared)
+                              .filter(models.UserTaskCounters.user_id == user_id))
+    row = result.first()
+    return (row.owned, row.shared) if row else (0, 0)
+
+
+async def check_consistency(db: AsyncSession, user_id: int | None = None, sample_size: int = 10):
+    """
+    Пользователи, у которых счётчики расходятся с user_visible_tasks
+    """
+    user_filter = "AND coalesce(e.user_id, c.user_id) = :user_id" if user_id is not None else ""
+    result = await db.execute(text(f"""
+        SELECT coalesce(e.user_id, c.user_id) AS user_id,
+               coalesce(e.owned, 0) AS expected_owned, coalesce(c.owned, 0) AS owned,
+               coalesce(e.shared, 0) AS expected_shared, coalesce(c.shared, 0) AS shared,
+               count(*) OVER () AS total
+        FROM ({EXPECTED_COUNTERS_SQL}) e
+        FULL JOIN user_task_counters c ON c.user_id = e.user_id
+        WHERE (coalesce(e.owned, 0) <> coalesce(c.owned, 0) OR coalesce(e.shared, 0) <> coalesce(c.shared, 0))
+        {user_filter}
+        LIMIT :sample_size
+    """), {"user_id": user_id, "sample_size": sample_size})
+    rows = result.mappings().all()
+    return {
+        "count": rows[0]["total"] if rows else 0,
+        "sample": [{key: value for key, value in row.items() if key != "total"} for row in rows],
+    }
+
+
+async def rebuild(db: AsyncSession, user_id: int | None = None):
+    """
+    Пересчитывает счётчики по user_visible_tasks целиком или для одного пользователя (без коммита)
+    """
+    user_filter = "WHERE user_id = :user_id" if user_id is not None else ""
+    params = {"user_id": user_id}
+
+    await db.execute(text(f"DELETE FROM user_task_counters {user_filter}"), params)
+    result = await db.execute(text(f"""
+        INSERT INTO user_task_counters (user_id, owned, shared)
+        SELECT user_id, owned, shared FROM ({EXPECTED_COUNTERS_SQL}) e {user_filter}
+    """), params)
+    return result.rowcount
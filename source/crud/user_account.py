@@ -47,6 +47,30 @@ def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRE_M
     return {"access_token": encoded_jwt, "expire_minutes": expires_minutes}
 
 
+def get_token_username(token: str):
+    """
+    Имя пользователя из действительного токена, иначе None (без обращения к БД)
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("username")
+
+
+async def get_user_id_by_token(db: AsyncSession, token: str):
+    """
+    id пользователя из токена одним запросом только users.id, без загрузки пользователя и его связей.
+    None - токен недействителен или пользователя нет
+    """
+    username = get_token_username(token)
+    if username is None:
+        return None
+
+    result = await db.execute(select(models.User.id).filter(models.User.username == username))
+    return result.scalar_one_or_none()
+
+
 async def check_user_token_auth(db: AsyncSession, token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
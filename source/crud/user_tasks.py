@@ -1,27 +1,106 @@
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import or_, and_
+from sqlalchemy import and_, func, delete, update, literal
 from source.models import models
 from source.schemas import schemas
-from source.crud import user_account
+from source.crud import user_account, user_visible_tasks, task_bodies, list_versions
+from source.cache import task_cache, TASK_CACHE_MAX_DESCRIPTION
+
+
+async def commit_or_flush(db: AsyncSession, commit: bool = True):
+    """
+    commit=False используется, когда несколько операций выполняются в одной транзакции (например, /batch):
+    изменения только отправляются в БД, а фиксирует транзакцию вызывающий код
+    """
+    if commit:
+        await db.commit()
+    else:
+        await db.flush()
+        # Незафиксированные изменения не должны попадать в кэш задач
+        db.info["uncommitted_task_changes"] = True
+
+
+async def invalidate_task_cache(db: AsyncSession, task_ids: list[int], commit: bool = True):
+    """
+    Вызывается вместо commit_or_flush в операциях, меняющих задачи или права на них.
+    NOTIFY отправляется в той же транзакции, поэтому остальные процессы сбрасывают записи
+    только после коммита, а локальные записи сбрасываются сразу
+    """
+    await task_cache.notify_invalidation(db, task_ids)
+    await commit_or_flush(db, commit)
+    for task_id in task_ids:
+        await task_cache.invalidate(task_id)
+
+
+# Корневая задача дерева, права которой действуют на задачу
+root_task_id = func.coalesce(models.Task.root_id, models.Task.id)
+
+
+async def get_root_task_id(db: AsyncSession, task_id: int):
+    result = await db.execute(select(root_task_id).filter(models.Task.id == task_id))
+    return result.scalar()
+
+
+def get_subtree_query(task_id: int):
+    """
+    Рекурсивный CTE (id, parent_id, depth) задачи task_id и всех её потомков
+    """
+    subtree = (
+        select(models.Task.id, models.Task.parent_id, literal(0).label("depth"))
+        .filter(models.Task.id == task_id)
+        .cte("subtree", recursive=True)
+    )
+    children = (
+        select(models.Task.id, models.Task.parent_id, (subtree.c.depth + 1).label("depth"))
+        .join(subtree, models.Task.parent_id == subtree.c.id)
+    )
+    return subtree.union_all(children)
+
+
+async def get_subtree_ids(db: AsyncSession, task_id: int):
+    subtree = get_subtree_query(task_id)
+    result = await db.execute(select(subtree.c.id))
+    return list(result.scalars())
 
 
 async def create_task(db: AsyncSession, task: schemas.TaskCreate):
     db_task = models.Task(**task.model_dump(mode="json"))
+    db_task.description, db_task.description_truncated = task_bodies.split_description(task.description)
     # print(db_task)
     db.add(db_task)
+    await db.flush()
+    if db_task.description_truncated:
+        await task_bodies.set_body(db, db_task.id, task.description)
+    await list_versions.bump_users(db, [db_task.owner_id])
+    await user_visible_tasks.set_visible_task(db, db_task.owner_id, db_task.id, db_task.owner_id, visible=True)
     await db.commit()
     await db.refresh(db_task)
     # print(db_task)
     return db_task
 
 
-async def create_task_with_permissions(db: AsyncSession, task: schemas.TaskCreate):
+async def create_task_with_permissions(db: AsyncSession, task: schemas.TaskCreate, commit: bool = True):
     new_task = models.Task(**task.model_dump(mode="json"))
+    new_task.description, new_task.description_truncated = task_bodies.split_description(task.description)
+
+    if task.parent_id is not None:
+        new_task.root_id = await get_root_task_id(db, task.parent_id)
+
     db.add(new_task)
 
     await db.flush()
 
+    if new_task.description_truncated:
+        await task_bodies.set_body(db, new_task.id, task.description)
+
+    await list_versions.bump_users(db, [new_task.owner_id])
+
+    if task.parent_id is not None:
+        # Подзадача наследует права корневой задачи, своих прав и строки в user_visible_tasks у неё нет
+        await commit_or_flush(db, commit)
+        await db.refresh(new_task)
+        return new_task
+
     owner_permission = models.TaskPermission(
         task_id=new_task.id,
         user_id=new_task.owner_id,
@@ -30,7 +109,10 @@ async def create_task_with_permissions(db: AsyncSession, task: schemas.TaskCreat
     )
     db.add(owner_permission)
 
-    await db.commit()
+    await user_visible_tasks.set_visible_task(db, new_task.owner_id, new_task.id, new_task.owner_id,
+                                              visible=True, can_update=True)
+
+    await commit_or_flush(db, commit)
 
     await db.refresh(new_task)
 
@@ -54,57 +136,81 @@ async def get_tasks_by_username(db: AsyncSession, username: str, skip: int = 0,
     return result.scalars().all()
 
 
-async def get_tasks_by_user_id(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 10):
-    """
-    Возвращает все задачи, к которым есть доступ у user_id. (Созданные им же и те, к которым ему дали доступ)
-    Также есть ограничения skip (сколько задач пропустить) и limit (сколько максимально можно вернуть задач)
-    """
-    query = (
+def get_tasks_by_user_id_query(user_id: int, skip: int = 0, limit: int = 10):
+    # Выборка по первичному ключу user_visible_tasks (user_id, task_id): один проход по индексу,
+    # при секционировании читается только секция пользователя. Соединение с tasks и по owner_id
+    # (ключу секционирования tasks): для каждой строки читается только секция владельца задачи
+    return (
         select(models.Task)
-        .join(models.Task.permissions, isouter=True)
-        .filter(
-            or_(
-                models.Task.owner_id == user_id,
-                models.TaskPermission.user_id == user_id
-            )
-        )
+        .join(models.UserVisibleTask, and_(models.UserVisibleTask.owner_id == models.Task.owner_id,
+                                           models.UserVisibleTask.task_id == models.Task.id))
+        .filter(models.UserVisibleTask.user_id == user_id)
+        .order_by(models.UserVisibleTask.task_id)
         .offset(skip)
         .limit(limit)
     )
-    result = await db.execute(query)
-    return result.scalars().unique().all()
 
 
-async def update_task(db: AsyncSession, task_id: int, task: schemas.TaskBase):
+async def get_tasks_by_user_id(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 10):
+    """
+    Возвращает все задачи, к которым есть доступ у user_id. (Созданные им же и те, к которым ему дали доступ на чтение)
+    Также есть ограничения skip (сколько задач пропустить) и limit (сколько максимально можно вернуть задач)
+    """
+    result = await db.execute(get_tasks_by_user_id_query(user_id, skip=skip, limit=limit))
+    return result.scalars().all()
+
+
+async def update_task(db: AsyncSession, task_id: int, task: schemas.TaskBase, commit: bool = True):
     result = await db.execute(select(models.Task).filter(models.Task.id == task_id))
     db_task = result.scalars().first()
 
     if db_task:
         db_task.title = task.title
-        db_task.description = task.description
-        await db.commit()
+        was_truncated = db_task.description_truncated
+        db_task.description, db_task.description_truncated = task_bodies.split_description(task.description)
+        if was_truncated or db_task.description_truncated:
+            await task_bodies.set_body(db, task_id, task.description)
+        await list_versions.bump_task_users(db, [task_id])
+        await invalidate_task_cache(db, [task_id], commit)
         await db.refresh(db_task)
         return db_task
     return None
 
 
-async def delete_task(db: AsyncSession, task_id: int):
+async def delete_task(db: AsyncSession, task_id: int, commit: bool = True):
     result = await db.execute(select(models.Task).filter(models.Task.id == task_id))
     db_task = result.scalars().first()
 
     if db_task:
+        # Задача удаляется вместе с подзадачами
+        subtree_ids = await get_subtree_ids(db, task_id)
+        descendant_ids = [subtree_id for subtree_id in subtree_ids if subtree_id != task_id]
+        await list_versions.bump_task_users(db, subtree_ids)
+        await task_bodies.delete_bodies(db, subtree_ids)
+        if descendant_ids:
+            await db.execute(delete(models.Task).filter(models.Task.id.in_(descendant_ids))
+                             .execution_options(synchronize_session=False))
+
+        # Права удаляются явно: иначе ORM обнулил бы task_id у строк task_permissions
+        await db.execute(delete(models.TaskPermission).filter(models.TaskPermission.task_id.in_(subtree_ids))
+                         .execution_options(synchronize_session=False))
+        if db_task.parent_id is None:
+            await user_visible_tasks.delete_visible_task(db, task_id, db_task.owner_id)
         await db.delete(db_task)
-        await db.commit()
+        await invalidate_task_cache(db, subtree_ids, commit)
         return True
     return False
 
 
 async def update_task_permissions(db: AsyncSession, task_id: int, user_id: int,
-                                  can_read: bool = None, can_update: bool = None):
+                                  can_read: bool = None, can_update: bool = None, commit: bool = True):
+    """
+    Права задаются только на корневую задачу (для подзадачи возвращается None, как и для несуществующей задачи)
+    """
     result = await db.execute(select(models.Task).filter(models.Task.id == task_id))
     db_task = result.scalars().first()
 
-    if not db_task:
+    if not db_task or db_task.parent_id is not None:
         return None
 
     result = await db.execute(select(models.TaskPermission).filter(
@@ -128,18 +234,95 @@ async def update_task_permissions(db: AsyncSession, task_id: int, user_id: int,
         if can_update is not None:
             task_permission.can_update = can_update
 
-    await db.commit()
+    await user_visible_tasks.set_visible_task(db, user_id, task_id, db_task.owner_id,
+                                              visible=user_id == db_task.owner_id or bool(task_permission.can_read),
+                                              can_update=bool(task_permission.can_update))
+
+    await list_versions.bump_users(db, [user_id])
+
+    # Права корневой задачи закэшированы и во всех её подзадачах
+    await invalidate_task_cache(db, await get_subtree_ids(db, task_id), commit)
     return schemas.TaskPermission(task_id=task_id, user_id=user_id,
                                   can_read=can_read or False, can_update=can_update or False)
 
 
-async def check_read_permission(db: AsyncSession, task_id: int, user_id: int):
-    result = await db.execute(select(models.TaskPermission).filter(
-        and_(
-            models.TaskPermission.task_id == task_id,
-            models.TaskPermission.user_id == user_id
-        )))
-    permission = result.scalars().first()
+async def get_task_cache_entry(db: AsyncSession, task_id: int):
+    """
+    Задача и права всех пользователей на неё через кэш (см. source/cache.py).
+    Полное описание попадает в запись, только если оно не больше TASK_CACHE_MAX_DESCRIPTION,
+    иначе в записи превью и description_truncated=True. Возвращает None, если задачи нет
+    """
+    # В транзакции с незафиксированными изменениями задач кэш не читается: запись могла быть заново
+    # заполнена старой строкой другим запросом, и операция не увидела бы собственных изменений
+    uncommitted = db.info.get("uncommitted_task_changes")
+    if not uncommitted:
+        entry = await task_cache.get(task_id)
+        if entry is not None:
+            return entry
+
+    # До чтения из БД: инвалидация во время чтения отменит запись в кэш
+    generation = task_cache.generation
+
+    result = await db.execute(
+        select(models.Task.id, models.Task.title, models.Task.description, models.Task.description_truncated,
+               models.Task.owner_id, models.Task.parent_id, root_task_id.label("root_id"))
+        .filter(models.Task.id == task_id)
+    )
+    task = result.mappings().first()
+
+    if not task:
+        return None
+
+    task = dict(task)
+    if task["description_truncated"] and await task_bodies.get_body_size(db, task_id) <= TASK_CACHE_MAX_DESCRIPTION:
+        task["description"] = await task_bodies.get_description(db, task_id)
+        task["description_truncated"] = False
+
+    result = await db.execute(
+        select(models.TaskPermission.user_id, models.TaskPermission.can_read, models.TaskPermission.can_update)
+        .filter(models.TaskPermission.task_id == task["root_id"])
+    )
+    entry = {
+        "task": {key: value for key, value in task.items() if key != "root_id"},
+        "permissions": {str(user_id): [bool(can_read), bool(can_update)] for user_id, can_read, can_update in result}
+    }
+
+    if not uncommitted:
+        await task_cache.set(task_id, entry, generation)
+    return entry
+
+
+def get_task_permission_query(task_id: int, user_id: int, owner_id: int | None = None):
+    # Права берутся с корневой задачи дерева одним запросом, без обхода предков.
+    # Условие по user_id (ключу секционирования task_permissions) позволяет читать только одну секцию.
+    # owner_id (ключ секционирования tasks) делает то же для tasks: без него задача ищется
+    # по ix_tasks_id во всех секциях
+    filters = [models.Task.id == task_id, models.TaskPermission.user_id == user_id]
+    if owner_id is not None:
+        filters.append(models.Task.owner_id == owner_id)
+
+    return (
+        select(models.TaskPermission)
+        .join(models.Task, models.TaskPermission.task_id == root_task_id)
+        .filter(and_(*filters))
+    )
+
+
+async def get_task_permission(db: AsyncSession, task_id: int, user_id: int, owner_id: int | None = None):
+    """
+    Права user_id на задачу task_id (права её корневой задачи), None - прав нет или задачи нет.
+    Если owner_id не передан, он берётся из локального кэша задач: владелец задачи не меняется, поэтому
+    даже устаревшая запись годится для отсечения секций, а сами права читаются из БД в текущей транзакции
+    """
+    if owner_id is None:
+        owner_id = task_cache.peek_owner_id(task_id)
+
+    result = await db.execute(get_task_permission_query(task_id, user_id, owner_id))
+    return result.scalars().first()
+
+
+async def check_read_permission(db: AsyncSession, task_id: int, user_id: int, owner_id: int | None = None):
+    permission = await get_task_permission(db, task_id, user_id, owner_id)
     # print(f"permission: {permission}")
 
     if permission and permission.can_read:
@@ -147,15 +330,65 @@ async def check_read_permission(db: AsyncSession, task_id: int, user_id: int):
     return False
 
 
-async def check_update_permission(db: AsyncSession, task_id: int, user_id: int):
-    result = await db.execute(select(models.TaskPermission).filter(
-        and_(
-            models.TaskPermission.task_id == task_id,
-            models.TaskPermission.user_id == user_id
-        )))
-    permission = result.scalars().first()
+async def check_update_permission(db: AsyncSession, task_id: int, user_id: int, owner_id: int | None = None):
+    permission = await get_task_permission(db, task_id, user_id, owner_id)
     # print(f"permission: {permission}")
 
     if permission and permission.can_update:
         return True
     return False
+
+
+async def get_subtree(db: AsyncSession, task_id: int):
+    """
+    Задача task_id и все её подзадачи одним рекурсивным запросом: список (задача, глубина) в порядке обхода по уровням
+    """
+    subtree = get_subtree_query(task_id)
+    result = await db.execute(
+        select(models.Task, subtree.c.depth)
+        .join(subtree, subtree.c.id == models.Task.id)
+        .order_by(subtree.c.depth, models.Task.id)
+    )
+    return result.all()
+
+
+async def move_task(db: AsyncSession, task_id: int, parent_id: int | None, commit: bool = True):
+    """
+    Переносит задачу вместе с подзадачами под parent_id (None - сделать корневой).
+    Проверка, что parent_id не внутри переносимого дерева, - на вызывающем коде
+    """
+    result = await db.execute(select(models.Task).filter(models.Task.id == task_id))
+    db_task = result.scalars().first()
+
+    if not db_task:
+        return None
+
+    subtree_ids = await get_subtree_ids(db, task_id)
+    new_root_id = await get_root_task_id(db, parent_id) if parent_id is not None else None
+
+    await list_versions.bump_task_users(db, subtree_ids)
+
+    if db_task.parent_id is None and parent_id is not None:
+        # Корневая задача становится подзадачей: её права и строки user_visible_tasks больше не действуют,
+        # у всех её потомков root_id и так равен task_id
+        await db.execute(delete(models.TaskPermission).filter(models.TaskPermission.task_id == task_id))
+        await user_visible_tasks.delete_visible_task(db, task_id, db_task.owner_id)
+        await db.execute(update(models.Task).filter(models.Task.root_id == task_id)
+                         .values(root_id=new_root_id).execution_options(synchronize_session=False))
+    elif db_task.parent_id is not None and parent_id is None:
+        # Подзадача становится корневой: владелец получает права, как при создании задачи
+        await db.execute(update(models.Task).filter(models.Task.id.in_(subtree_ids), models.Task.id != task_id)
+                         .values(root_id=task_id).execution_options(synchronize_session=False))
+        db.add(models.TaskPermission(task_id=task_id, user_id=db_task.owner_id, can_read=True, can_update=True))
+        await user_visible_tasks.set_visible_task(db, db_task.owner_id, task_id, db_task.owner_id,
+                                                  visible=True, can_update=True)
+    elif db_task.parent_id is not None and new_root_id != db_task.root_id:
+        await db.execute(update(models.Task).filter(models.Task.id.in_(subtree_ids), models.Task.id != task_id)
+                         .values(root_id=new_root_id).execution_options(synchronize_session=False))
+
+    db_task.parent_id = parent_id
+    db_task.root_id = new_root_id
+
+    await invalidate_task_cache(db, subtree_ids, commit)
+    await db.refresh(db_task)
+    return db_task
@@ -0,0 +1,112 @@
+from collections import Counter
+from sqlalchemy import text, func, delete, literal_column
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from source.models import models
+from source.crud import task_counters
+
+
+# Ожидаемое содержимое user_visible_tasks, вычисленное по tasks и task_permissions:
+# владелец видит свою задачу всегда, остальные - при can_read. В списке только корневые задачи,
+# подзадачи получаются через /tasks/tree/{task_id}. owner_id - владелец задачи (ключ секционирования tasks)
+EXPECTED_VISIBLE_TASKS_SQL = """
+    SELECT t.owner_id AS user_id, t.id AS task_id, t.owner_id AS owner_id, coalesce(p.can_update, false) AS can_update
+    FROM tasks t
+    LEFT JOIN task_permissions p ON p.task_id = t.id AND p.user_id = t.owner_id
+    WHERE t.owner_id IS NOT NULL AND t.parent_id IS NULL
+    UNION ALL
+    SELECT p.user_id, p.task_id, t.owner_id, coalesce(p.can_update, false)
+    FROM task_permissions p
+    JOIN tasks t ON t.id = p.task_id
+    WHERE p.can_read AND p.user_id <> t.owner_id AND t.parent_id IS NULL
+"""
+
+
+async def set_visible_task(db: AsyncSession, user_id: int, task_id: int, owner_id: int, visible: bool,
+                           can_update: bool = False):
+    """
+    Добавляет/обновляет или удаляет строку user_visible_tasks и изменяет счётчики пользователя,
+    если строка действительно появилась или пропала (без коммита). owner_id - владелец задачи
+    """
+    owner = user_id == owner_id
+    if visible:
+        statement = insert(models.UserVisibleTask).values(user_id=user_id, task_id=task_id, owner_id=owner_id,
+                                                          can_update=bool(can_update))
+        result = await db.execute(statement.on_conflict_do_update(
+            index_elements=[models.UserVisibleTask.user_id, models.UserVisibleTask.task_id],
+            set_={"can_update": statement.excluded.can_update, "owner_id": statement.excluded.owner_id}
+        ).returning(literal_column("xmax = 0")))  # xmax = 0 - строка вставлена, а не обновлена
+        delta = 1 if result.scalar_one() else 0
+    else:
+        result = await db.execute(delete(models.UserVisibleTask).filter(
+            models.UserVisibleTask.user_id == user_id,
+            models.UserVisibleTask.task_id == task_id
+        ).returning(models.UserVisibleTask.user_id))
+        delta = -1 if result.first() else 0
+
+    if delta:
+        change = Counter({user_id: delta})
+        await task_counters.adjust_counters(db, owned=change if owner else None, shared=None if owner else change)
+
+
+async def delete_visible_task(db: AsyncSession, task_id: int, owner_id: int):
+    result = await db.execute(delete(models.UserVisibleTask)
+                              .filter(models.UserVisibleTask.task_id == task_id)
+                              .returning(models.UserVisibleTask.user_id))
+
+    owned, shared = Counter(), Counter()
+    for user_id in result.scalars():
+        if user_id == owner_id:
+            owned[user_id] -= 1
+        else:
+            shared[user_id] -= 1
+    await task_counters.adjust_counters(db, owned=owned, shared=shared)
+
+
+async def count_visible_tasks(db: AsyncSession, user_id: int):
+    result = await db.execute(select(func.count()).select_from(models.UserVisibleTask)
+                              .filter(models.UserVisibleTask.user_id == user_id))
+    return result.scalar_one()
+
+
+async def check_consistency(db: AsyncSession, user_id: int | None = None, sample_size: int = 10):
+    """
+    Сравнивает user_visible_tasks с ожидаемым содержимым.
+    missing - строк не хватает (или у них другой can_update), extra - лишние строки
+    """
+    user_filter = "WHERE user_id = :user_id" if user_id is not None else ""
+    params = {"user_id": user_id, "sample_size": sample_size}
+
+    report = {}
+    for name, left, right in (("missing", "expected", "actual"), ("extra", "actual", "expected")):
+        result = await db.execute(text(f"""
+            WITH expected AS (SELECT * FROM ({EXPECTED_VISIBLE_TASKS_SQL}) e {user_filter}),
+                 actual AS (SELECT user_id, task_id, owner_id, can_update FROM user_visible_tasks {user_filter}),
+                 diff AS (SELECT * FROM {left} EXCEPT SELECT * FROM {right})
+            SELECT (SELECT count(*) FROM diff) AS total, user_id, task_id, owner_id, can_update
+            FROM diff LIMIT :sample_size
+        """), params)
+        rows = result.all()
+        report[name] = {
+            "count": rows[0].total if rows else 0,
+            "sample": [{"user_id": row.user_id, "task_id": row.task_id, "owner_id": row.owner_id,
+                        "can_update": row.can_update}
+                       for row in rows],
+        }
+    return report
+
+
+async def rebuild(db: AsyncSession, user_id: int | None = None):
+    """
+    Пересобирает user_visible_tasks целиком или для одного пользователя (без коммита)
+    """
+    user_filter = "WHERE user_id = :user_id" if user_id is not None else ""
+    params = {"user_id": user_id}
+
+    await db.execute(text(f"DELETE FROM user_visible_tasks {user_filter}"), params)
+    result = await db.execute(text(f"""
+        INSERT INTO user_visible_tasks (user_id, task_id, owner_id, can_update)
+        SELECT user_id, task_id, owner_id, can_update FROM ({EXPECTED_VISIBLE_TASKS_SQL}) e {user_filter}
+    """), params)
+    return result.rowcount
@@ -0,0 +1,344 @@
+"""
+Фоновые задачи (массовая выдача прав, импорт, экспорт и удаление всех задач пользователя).
+
+Задачи хранятся в таблице jobs. Каждый процесс приложения запускает JobRunner с ограниченным
+числом исполнителей, которые забирают задачи через SELECT ... FOR UPDATE SKIP LOCKED,
+поэтому несколько процессов делят одну очередь без повторного выполнения.
+Задача, от которой дольше JOB_STALE_SECONDS нет отметок о ходе выполнения (процесс упал),
+забирается заново.
+
+Обработчик получает JobContext и сообщает ход выполнения через ctx.set_progress(),
+там же проверяется отмена (JobCancelled). Задача может выполняться повторно (зависший процесс,
+остановка JobRunner), поэтому неидемпотентные обработчики сохраняют ctx.save_checkpoint()
+в транзакции каждой порции и продолжают с ctx.progress/ctx.checkpoint.
+"""
+import asyncio
+import logging
+from sqlalchemy import update, func, or_, and_, case
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from source.models import models
+from source.schemas import schemas
+from source.crud import user_tasks, task_bodies
+import source.database as database
+from secret_data import config
+
+
+JOB_CONCURRENCY = getattr(config, "JOB_CONCURRENCY", 2)
+JOB_POLL_INTERVAL = getattr(config, "JOB_POLL_INTERVAL", 1.0)
+JOB_STALE_SECONDS = getattr(config, "JOB_STALE_SECONDS", 300)
+# Сколько элементов обрабатывается в одной транзакции
+JOB_CHUNK_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_handler(kind: str):
+    def decorator(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+class JobContext:
+    def __init__(self, job_id: int, owner_id: int, params: dict, progress: int = 0, checkpoint: dict | None = None):
+        self.job_id = job_id
+        self.owner_id = owner_id
+        self.params = params
+        # Состояние, сохранённое предыдущей попыткой выполнения
+        self.progress = progress
+        self.checkpoint = checkpoint
+
+    async def save_checkpoint(self, db: AsyncSession, progress: int, checkpoint: dict):
+        """
+        Сохраняет ход выполнения в транзакции db (без коммита): коммит порции работы и отметки атомарен
+        """
+        await db.execute(update(models.Job).filter(models.Job.id == self.job_id).values(
+            progress=progress, result=checkpoint, heartbeat_at=func.now(), updated_at=func.now()
+        ))
+        self.progress = progress
+        self.checkpoint = checkpoint
+
+    async def set_progress(self, progress: int, total: int | None = None):
+        """
+        Сохраняет ход выполнения (это же отметка, что задача жива) и бросает JobCancelled, если задачу отменили
+        """
+        values = {"progress": progress, "heartbeat_at": func.now(), "updated_at": func.now()}
+        if total is not None:
+            values["total"] = total
+
+        async with database.SessionLocal() as db:
+            result = await db.execute(update(models.Job).filter(models.Job.id == self.job_id).values(**values)
+                                      .returning(models.Job.cancel_requested))
+            cancel_requested = result.scalar_one()
+            await db.commit()
+
+        if cancel_requested:
+            raise JobCancelled()
+
+
+async def enqueue_job(db: AsyncSession, kind: str, owner_id: int, params: dict, total: int | None = None):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Неизвестный тип задачи '{kind}'")
+
+    job = models.Job(kind=kind, owner_id=owner_id, params=params, total=total)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    job_runner.wake_up()
+    return job
+
+
+async def get_job(db: AsyncSession, job_id: int):
+    result = await db.execute(select(models.Job).filter(models.Job.id == job_id))
+    return result.scalars().first()
+
+
+async def cancel_job(db: AsyncSession, job_id: int):
+    """
+    Задача в очереди отменяется сразу, выполняющаяся - при следующем set_progress
+    """
+    await db.execute(update(models.Job).filter(models.Job.id == job_id).values(
+        cancel_requested=True,
+        status=case((models.Job.status == "queued", "cancelled"), else_=models.Job.status),
+        updated_at=func.now(),
+    ))
+    await db.commit()
+    return await get_job(db, job_id)
+
+
+async def claim_job(db: AsyncSession):
+    """
+    Забирает одну задачу из очереди (или зависшую), другие процессы её не увидят благодаря SKIP LOCKED
+    """
+    stale = func.now() - func.make_interval(0, 0, 0, 0, 0, 0, JOB_STALE_SECONDS)
+    pending_job_id = (
+        select(models.Job.id)
+        .filter(or_(
+            models.Job.status == "queued",
+            and_(models.Job.status == "running", models.Job.heartbeat_at < stale),
+        ))
+        .order_by(models.Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(models.Job)
+        .filter(models.Job.id == pending_job_id)
+        .values(status="running", attempts=models.Job.attempts + 1, heartbeat_at=func.now(), updated_at=func.now())
+        .returning(models.Job.id, models.Job.owner_id, models.Job.kind, models.Job.params, models.Job.progress,
+                   models.Job.result)
+    )
+    job = result.first()
+    await db.commit()
+    return job
+
+
+async def finish_job(job_id: int, status: str, result: dict | None = None, error: str | None = None):
+    """
+    Задача, возвращаемая в очередь (status="queued"), сохраняет result - там отметка ctx.save_checkpoint()
+    """
+    values = {"status": status, "updated_at": func.now()}
+    if status != "queued":
+        values.update(result=result, error=error)
+
+    async with database.SessionLocal() as db:
+        await db.execute(update(models.Job).filter(models.Job.id == job_id).values(**values))
+        await db.commit()
+
+
+class JobRunner:
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, poll_interval: float = JOB_POLL_INTERVAL):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._workers = []
+        self._wake_up = asyncio.Event()
+
+    def wake_up(self):
+        self._wake_up.set()
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """
+        Прерывает исполнителей. Прерванная задача возвращается в очередь
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка при получении фоновой задачи")
+
+            self._wake_up.clear()
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_once(self):
+        """
+        Выполняет одну задачу из очереди. Возвращает False, если очередь пуста
+        """
+        async with database.SessionLocal() as db:
+            job = await claim_job(db)
+
+        if job is None:
+            return False
+
+        ctx = JobContext(job.id, job.owner_id, job.params, progress=job.progress, checkpoint=job.result)
+        try:
+            result = await JOB_HANDLERS[job.kind](ctx)
+        except JobCancelled:
+            await finish_job(job.id, "cancelled")
+        except asyncio.CancelledError:
+            await asyncio.shield(finish_job(job.id, "queued"))
+            raise
+        except Exception as e:
+            logger.exception(f"Фоновая задача {job.id} ({job.kind}) завершилась с ошибкой")
+            await finish_job(job.id, "failed", error=repr(e))
+        else:
+            await finish_job(job.id, "succeeded", result=result)
+        return True
+
+
+job_runner = JobRunner()
+
+
+def chunks(items: list, size: int = JOB_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+@job_handler("bulk_share")
+async def bulk_share(ctx: JobContext):
+    """
+    Выдача прав на задачи пользователя ctx.owner_id. Задачи других владельцев пропускаются
+    """
+    params = schemas.BulkShare.model_validate(ctx.params)
+    pairs = [(task_id, user_id) for task_id in params.task_ids for user_id in params.user_ids]
+    done, skipped = 0, []
+
+    await ctx.set_progress(0, len(pairs))
+
+    for chunk in chunks(pairs):
+        async with database.SessionLocal() as db:
+            result = await db.execute(select(models.Task.id).filter(
+                models.Task.id.in_({task_id for task_id, user_id in chunk}),
+                models.Task.owner_id == ctx.owner_id
+            ))
+            own_task_ids = set(result.scalars())
+
+            for task_id, user_id in chunk:
+                if task_id not in own_task_ids:
+                    skipped.append(task_id)
+                    continue
+                await user_tasks.update_task_permissions(db, task_id, user_id, can_read=params.can_read,
+                                                         can_update=params.can_update, commit=False)
+            await db.commit()
+
+        done += len(chunk)
+        await ctx.set_progress(done)
+
+    return {"shared": done - len(skipped), "skipped_task_ids": sorted(set(skipped))}
+
+
+@job_handler("import_tasks")
+async def import_tasks(ctx: JobContext):
+    """
+    Импорт продолжается с первой незакоммиченной порции: число импортированных задач сохраняется
+    в той же транзакции, что и сами задачи, поэтому повторное выполнение не создаёт дубликатов
+    """
+    tasks = [schemas.TaskBase.model_validate(task) for task in ctx.params["tasks"]]
+    done = ctx.progress
+    first_task_id = (ctx.checkpoint or {}).get("first_task_id")
+
+    await ctx.set_progress(done, len(tasks))
+
+    for chunk in chunks(tasks[done:]):
+        async with database.SessionLocal() as db:
+            for task in chunk:
+                db_task = await user_tasks.create_task_with_permissions(
+                    db, schemas.TaskCreate(**task.model_dump(), owner_id=ctx.owner_id), commit=False
+                )
+                if first_task_id is None:
+                    first_task_id = db_task.id
+            done += len(chunk)
+            await ctx.save_checkpoint(db, done, {"created": done, "first_task_id": first_task_id})
+            await db.commit()
+
+        await ctx.set_progress(done)
+
+    return {"created": done, "first_task_id": first_task_id}
+
+
+@job_handler("export_tasks")
+async def export_tasks(ctx: JobContext):
+    """
+    Задачи пользователя с полными описаниями в формате /tasks/import (id и parent_id импорт не использует).
+    Только чтение, поэтому повторное выполнение начинается сначала. Результат хранится в jobs.result целиком
+    """
+    async with database.SessionLocal() as db:
+        result = await db.execute(select(models.Task.id).filter(models.Task.owner_id == ctx.owner_id)
+                                  .order_by(models.Task.id))
+        task_ids = list(result.scalars())
+
+    await ctx.set_progress(0, len(task_ids))
+
+    tasks = []
+    for chunk in chunks(task_ids):
+        async with database.SessionLocal() as db:
+            result = await db.execute(select(models.Task).filter(models.Task.owner_id == ctx.owner_id,
+                                                                 models.Task.id.in_(chunk))
+                                      .order_by(models.Task.id))
+            for db_task in result.scalars():
+                description = db_task.description
+                if db_task.description_truncated:
+                    description = await task_bodies.get_description(db, db_task.id)
+                tasks.append({"id": db_task.id, "parent_id": db_task.parent_id, "title": db_task.title,
+                              "description": description})
+
+        await ctx.set_progress(len(tasks))
+
+    return {"tasks": tasks}
+
+
+@job_handler("purge_tasks")
+async def purge_tasks(ctx: JobContext):
+    """
+    Удаление всех задач, созданных пользователем
+    """
+    async with database.SessionLocal() as db:
+        result = await db.execute(select(models.Task.id).filter(models.Task.owner_id == ctx.owner_id)
+                                  .order_by(models.Task.id))
+        task_ids = list(result.scalars())
+
+    await ctx.set_progress(0, len(task_ids))
+
+    deleted = 0
+    for chunk in chunks(task_ids):
+        async with database.SessionLocal() as db:
+            for task_id in chunk:
+                deleted += bool(await user_tasks.delete_task(db, task_id, commit=False))
+            await db.commit()
+
+        await ctx.set_progress(deleted)
+
+    return {"deleted": deleted}
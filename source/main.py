@@ -1,14 +1,23 @@
-from fastapi import FastAPI, Depends, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, Request, HTTPException, Header, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
+from pydantic import TypeAdapter, ValidationError
 from source.schemas import schemas
-from source.crud import user_account, user_tasks
+from source.crud import user_account, user_tasks, task_counters, task_bodies, list_versions
 import source.database as database
+from source import migrations
+from source.cache import task_cache
+from source import profiling
+from source import compression
+from source import jobs
+from secret_data import config
 from typing import List
 from contextlib import asynccontextmanager
-import uvicorn
+import asyncio
+import json
 import os
+import secrets
 
 
 class CustomHTTPException(HTTPException):
@@ -22,17 +31,30 @@ class CustomHTTPException(HTTPException):
 
 @asynccontextmanager
 async def lifespan(app_: FastAPI):
+    # Схема создаётся и обновляется отдельной командой: python -m source.migrations upgrade
+    # При старте только проверяется, что схема БД не старее ревизии, которую знает приложение,
+    # и что применённые миграции не требуют более новой версии приложения
     if os.getenv("TESTING") != "true":  # Проверка на тестовую среду
-        await database.create_all_tables()
+        await migrations.check_schema_revision(database.engine)
+        await task_cache.start_listener(database.engine)
+        await profiling.profiler.start_listener(database.engine)
+        jobs.job_runner.start()
 
     yield
 
-    # В проде нужно закомментировать database.drop_all_tables(),
-    # он есть для удобства тестирования
-    if os.getenv("TESTING") != "true":  # Проверка на тестовую среду
-        await database.drop_all_tables()
+    # Вызывается после завершения всех текущих запросов
+    await jobs.job_runner.stop()
+    await task_cache.stop_listener()
+    await profiling.profiler.stop_listener()
+    await database.engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
+# Замеры фаз endpoint/serialization для профилирования, должно быть до объявления маршрутов
+app.router.route_class = profiling.ProfiledRoute
+# Профилирование добавляется последним, чтобы в замеры попадало и сжатие ответа
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+profiling.install_db_timing(database.engine)
 get_db = database.get_db
 
 
@@ -57,7 +79,8 @@ async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_d
 
 
 async def check_user_auth_with_raise(db, user):
-    check_user = await user_account.check_user_auth(db, user)
+    with profiling.phase("auth"):
+        check_user = await user_account.check_user_auth(db, user)
 
     if not check_user:
         error_code = 403
@@ -76,7 +99,8 @@ async def login_for_access_token(user: schemas.UserCreate, db: AsyncSession = De
 
 
 async def check_user_token_auth_with_raise(db, token):
-    check_user = await user_account.check_user_token_auth(db, token)
+    with profiling.phase("auth"):
+        check_user = await user_account.check_user_token_auth(db, token)
 
     if not check_user:
         error_code = 403
@@ -85,68 +109,204 @@ async def check_user_token_auth_with_raise(db, token):
     return check_user
 
 
-@app.post("/users/check_token_auth", response_model=schemas.MoreUserInfo)
 async def check_auth(token: str, db: AsyncSession = Depends(get_db)):
     return await check_user_token_auth_with_raise(db, token)
 
 
+async def check_auth_user_id(token: str, db: AsyncSession = Depends(get_db)):
+    """
+    Для горячих путей, которым нужен только id пользователя: один SELECT users.id вместо загрузки
+    пользователя со всеми задачами и правами (selectin)
+    """
+    with profiling.phase("auth"):
+        user_id = await user_account.get_user_id_by_token(db, token)
+
+    if user_id is None:
+        error_code = 403
+        error_json = {"error": {"message": "Проверка токена пользователя не пройдена", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+    return user_id
+
+
+# Условные запросы к спискам: слабый ETag из счётчика изменений пользователя (crud/list_versions.py).
+# Совпавший If-None-Match даёт 304 до загрузки пользователя и выборки списка
+
+async def get_list_etag(db: AsyncSession, token: str, *parts):
+    """
+    Возвращает (user_id, ETag), (None, None) - токен недействителен (тогда запрос получает 403)
+    """
+    username = user_account.get_token_username(token)
+    if username is None:
+        return None, None
+
+    with profiling.phase("auth"):
+        user_version = await list_versions.get_version_by_username(db, username)
+
+    if user_version is None:
+        return None, None
+    return user_version[0], 'W/"' + ".".join(str(part) for part in (*user_version, *parts)) + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str | None):
+    """
+    Слабое сравнение: префикс W/ не учитывается
+    """
+    if not if_none_match or etag is None:
+        return False
+
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+@app.post("/users/check_token_auth", response_model=schemas.MoreUserInfo)
+async def read_user_info(token: str, response: Response, if_none_match: str | None = Header(None),
+                         db: AsyncSession = Depends(get_db)):
+    _, etag = await get_list_etag(db, token, "user")
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    user = await check_user_token_auth_with_raise(db, token)
+
+    if etag is not None:
+        response.headers["ETag"] = etag
+    return user
+
+
+# Операции с задачами вынесены в отдельные функции с параметром commit,
+# чтобы их можно было выполнять и по одной, и несколькими в одной транзакции через /batch
+
+async def create_task_operation(db: AsyncSession, user, task: schemas.TaskCreate, commit: bool = True):
+    if task.parent_id is not None and not await user_tasks.check_update_permission(db, task.parent_id, user.id):
+        error_code = 403
+        error_json = {"error": {"message": f"Не достаточно прав для добавления подзадачи в '{task.parent_id}'",
+                                "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    return await user_tasks.create_task_with_permissions(db=db, task=task, commit=commit)
+
+
 @app.post("/tasks/create", response_model=schemas.Task)
 async def create_task(task: schemas.TaskCreate, db: AsyncSession = Depends(get_db),
                       user=Depends(check_auth)):
-    db_task = await user_tasks.create_task_with_permissions(db=db, task=task)
+    db_task = await create_task_operation(db, user, task)
 
     # print(db_task)
 
     return db_task
 
 
-@app.post("/tasks/update_permissions/{task_id}", response_model=schemas.TaskPermission)
-async def update_task_permissions(task_permission_data: schemas.TaskPermissionUpdate, task_id: int,
-                                  db: AsyncSession = Depends(get_db), token_check=Depends(check_auth)):
+async def update_task_permissions_operation(db: AsyncSession, user, task_id: int,
+                                            task_permission_data: schemas.TaskPermissionUpdate, commit: bool = True):
+    root_id = await user_tasks.get_root_task_id(db, task_id)
+
+    if root_id is None:
+        error_code = 404
+        error_json = {"error": {"message": f"Задача '{task_id}' не найдена", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    if root_id != task_id:
+        error_code = 400
+        error_json = {"error": {"message": f"Права подзадачи '{task_id}' наследуются от корневой задачи '{root_id}'",
+                                "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
     user_id = task_permission_data.user_id
     can_read = task_permission_data.can_read
     can_update = task_permission_data.can_update
 
     task_permissions = await user_tasks.update_task_permissions(db, task_id, user_id,
-                                                                can_read=can_read, can_update=can_update)
+                                                                can_read=can_read, can_update=can_update,
+                                                                commit=commit)
 
     return task_permissions
 
 
-@app.post("/tasks/read/{task_id}", response_model=schemas.Task)
-async def read_task(task_id: int, db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
-    if not await user_tasks.check_read_permission(db, task_id, user.id):
+@app.post("/tasks/update_permissions/{task_id}", response_model=schemas.TaskPermission)
+async def update_task_permissions(task_permission_data: schemas.TaskPermissionUpdate, task_id: int,
+                                  db: AsyncSession = Depends(get_db), token_check=Depends(check_auth)):
+    return await update_task_permissions_operation(db, token_check, task_id, task_permission_data)
+
+
+async def read_task_operation(db: AsyncSession, user_id: int, task_id: int):
+    # Задача и права читаются через кэш: несуществующая задача, как и раньше, даёт 403
+    task_entry = await user_tasks.get_task_cache_entry(db, task_id)
+    permission = task_entry["permissions"].get(str(user_id)) if task_entry else None
+
+    if not permission or not permission[0]:
         error_code = 403
         error_json = {"error": {"message": f"Не достаточно прав для чтения задачи '{task_id}'", "code": error_code}}
         raise CustomHTTPException(error_code, error_json)
 
-    db_task = await user_tasks.get_task(db, task_id)
+    task = task_entry["task"]
+    if task["description_truncated"]:
+        # Слишком длинное для кэша описание читается из task_bodies при каждом запросе
+        task = {**task, "description": await task_bodies.get_description(db, task_id), "description_truncated": False}
 
-    if not db_task:
-        error_code = 404
-        error_json = {"error": {"message": f"Задача '{task_id}' не найдена", "code": error_code}}
+    return task
+
+
+@app.post("/tasks/read/{task_id}", response_model=schemas.Task)
+async def read_task(task_id: int, db: AsyncSession = Depends(get_db), user_id=Depends(check_auth_user_id)):
+    return await read_task_operation(db, user_id, task_id)
+
+
+@app.post("/tasks/read_description/{task_id}")
+async def read_task_description(task_id: int, offset: int = Query(0, ge=0), length: int | None = Query(None, gt=0),
+                                db: AsyncSession = Depends(get_db), user_id=Depends(check_auth_user_id)):
+    """
+    Полное описание задачи (text/plain, UTF-8) потоком, целиком или байты [offset, offset + length).
+    Размер всего описания - в заголовке X-Description-Size
+    """
+    if not await user_tasks.check_read_permission(db, task_id, user_id):
+        error_code = 403
+        error_json = {"error": {"message": f"Не достаточно прав для чтения задачи '{task_id}'", "code": error_code}}
         raise CustomHTTPException(error_code, error_json)
 
-    return db_task
+    total, content_length, content = await task_bodies.get_description_range(db, task_id, offset, length)
+
+    return StreamingResponse(content, media_type="text/plain; charset=utf-8",
+                             headers={"Content-Length": str(content_length), "X-Description-Size": str(total)})
+
+
+async def read_tasks_operation(db: AsyncSession, user_id: int, read_task_params: schemas.ReadTaskParams):
+    return await user_tasks.get_tasks_by_user_id(db, user_id, skip=read_task_params.skip,
+                                                 limit=read_task_params.limit)
 
 
 @app.post("/tasks/read_tasks", response_model=List[schemas.Task])
-async def read_tasks(read_task_params: schemas.ReadTaskParams = schemas.ReadTaskParams(),
-                     db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
-    tasks = await user_tasks.get_tasks_by_user_id(db, user.id, skip=read_task_params.skip, limit=read_task_params.limit)
+async def read_tasks(token: str, response: Response,
+                     read_task_params: schemas.ReadTaskParams = schemas.ReadTaskParams(),
+                     if_none_match: str | None = Header(None), db: AsyncSession = Depends(get_db)):
+    # Пользователь не загружается: для выборки по user_visible_tasks нужен только id из запроса ETag
+    user_id, etag = await get_list_etag(db, token, "tasks", read_task_params.skip, read_task_params.limit)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if user_id is None:
+        error_code = 403
+        error_json = {"error": {"message": "Проверка токена пользователя не пройдена", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
 
+    tasks = await read_tasks_operation(db, user_id, read_task_params)
+
+    response.headers["ETag"] = etag
     return tasks
 
 
-@app.post("/tasks/update/{task_id}", response_model=schemas.Task)
-async def update_task(task_id: int, task: schemas.TaskBase,
-                      db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+@app.post("/tasks/summary", response_model=schemas.TaskSummary)
+async def read_tasks_summary(db: AsyncSession = Depends(get_db), user_id=Depends(check_auth_user_id)):
+    owned, shared = await task_counters.get_counters(db, user_id)
+
+    return schemas.TaskSummary(owned=owned, shared=shared, total=owned + shared)
+
+
+async def update_task_operation(db: AsyncSession, user, task_id: int, task: schemas.TaskBase, commit: bool = True):
     if not await user_tasks.check_update_permission(db, task_id, user.id):
         error_code = 403
         error_json = {"error": {"message": f"Не достаточно прав для обновления задачи '{task_id}'", "code": error_code}}
         raise CustomHTTPException(error_code, error_json)
 
-    db_task = await user_tasks.update_task(db, task_id, task)
+    db_task = await user_tasks.update_task(db, task_id, task, commit=commit)
 
     if not db_task:
         error_code = 404
@@ -156,17 +316,356 @@ async def update_task(task_id: int, task: schemas.TaskBase,
     return db_task
 
 
-@app.post("/tasks/delete/{task_id}")
-async def delete_task(task_id: int, db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
-    db_task = await user_tasks.delete_task(db=db, task_id=task_id)
+@app.post("/tasks/update/{task_id}", response_model=schemas.Task)
+async def update_task(task_id: int, task: schemas.TaskBase,
+                      db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+    return await update_task_operation(db, user, task_id, task)
+
+
+async def delete_task_operation(db: AsyncSession, user, task_id: int, commit: bool = True):
+    db_task = await user_tasks.get_task(db, task_id)
 
     if not db_task:
         error_code = 404
         error_json = {"error": {"message": f"Задача '{task_id}' не найдена", "code": error_code}}
         raise CustomHTTPException(error_code, error_json)
 
+    if not await user_tasks.check_update_permission(db, task_id, user.id, owner_id=db_task.owner_id):
+        error_code = 403
+        error_json = {"error": {"message": f"Не достаточно прав для удаления задачи '{task_id}'", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    # Вместе с корневой задачей удаляются её права у всех пользователей, поэтому удалить её может только создатель
+    if db_task.parent_id is None and db_task.owner_id != user.id:
+        error_code = 403
+        error_json = {"error": {"message": f"Корневую задачу '{task_id}' может удалить только её создатель",
+                                "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    await user_tasks.delete_task(db=db, task_id=task_id, commit=commit)
+
     return {"status": "success"}
 
 
+@app.post("/tasks/delete/{task_id}")
+async def delete_task(task_id: int, db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+    return await delete_task_operation(db, user, task_id)
+
+
+@app.post("/tasks/tree/{task_id}", response_model=List[schemas.TaskTreeNode])
+async def read_task_tree(task_id: int, db: AsyncSession = Depends(get_db), user_id=Depends(check_auth_user_id)):
+    """
+    Задача и все её подзадачи (parent_id, depth) одним запросом. Права проверяются один раз - на корневой задаче
+    """
+    if not await user_tasks.check_read_permission(db, task_id, user_id):
+        error_code = 403
+        error_json = {"error": {"message": f"Не достаточно прав для чтения задачи '{task_id}'", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    subtree = await user_tasks.get_subtree(db, task_id)
+
+    return [schemas.TaskTreeNode(**schemas.Task.model_validate(task).model_dump(), depth=depth)
+            for task, depth in subtree]
+
+
+async def move_task_operation(db: AsyncSession, user, task_id: int, task_move: schemas.TaskMove, commit: bool = True):
+    db_task = await user_tasks.get_task(db, task_id)
+
+    if not db_task or not await user_tasks.check_update_permission(db, task_id, user.id, owner_id=db_task.owner_id):
+        error_code = 403
+        error_json = {"error": {"message": f"Не достаточно прав для переноса задачи '{task_id}'", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    parent_id = task_move.parent_id
+
+    if parent_id is not None:
+        if not await user_tasks.check_update_permission(db, parent_id, user.id):
+            error_code = 403
+            error_json = {"error": {"message": f"Не достаточно прав для добавления подзадачи в '{parent_id}'",
+                                    "code": error_code}}
+            raise CustomHTTPException(error_code, error_json)
+
+        if parent_id in await user_tasks.get_subtree_ids(db, task_id):
+            error_code = 400
+            error_json = {"error": {"message": f"Задачу '{task_id}' нельзя перенести в её же подзадачу '{parent_id}'",
+                                    "code": error_code}}
+            raise CustomHTTPException(error_code, error_json)
+
+        # Права корневой задачи при переносе пропадают, поэтому переносить её может только создатель
+        if db_task.parent_id is None and db_task.owner_id != user.id:
+            error_code = 403
+            error_json = {"error": {"message": f"Корневую задачу '{task_id}' может перенести только её создатель",
+                                    "code": error_code}}
+            raise CustomHTTPException(error_code, error_json)
+
+    return await user_tasks.move_task(db, task_id, parent_id, commit=commit)
+
+
+@app.post("/tasks/move/{task_id}", response_model=schemas.Task)
+async def move_task(task_id: int, task_move: schemas.TaskMove, db: AsyncSession = Depends(get_db),
+                    user=Depends(check_auth)):
+    return await move_task_operation(db, user, task_id, task_move)
+
+
+# Долгие операции выполняются фоновыми задачами (source/jobs.py), ход выполнения - /jobs/{job_id}
+
+@app.post("/tasks/bulk_share", response_model=schemas.Job, status_code=202)
+async def bulk_share_tasks(bulk_share_data: schemas.BulkShare, db: AsyncSession = Depends(get_db),
+                           user=Depends(check_auth)):
+    return await jobs.enqueue_job(db, "bulk_share", user.id, bulk_share_data.model_dump(mode="json"),
+                                  total=len(bulk_share_data.task_ids) * len(bulk_share_data.user_ids))
+
+
+@app.post("/tasks/import", response_model=schemas.Job, status_code=202)
+async def import_tasks(task_import: schemas.TaskImport, db: AsyncSession = Depends(get_db),
+                       user=Depends(check_auth)):
+    return await jobs.enqueue_job(db, "import_tasks", user.id, task_import.model_dump(mode="json"),
+                                  total=len(task_import.tasks))
+
+
+@app.post("/tasks/export", response_model=schemas.Job, status_code=202)
+async def export_tasks(db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+    return await jobs.enqueue_job(db, "export_tasks", user.id, {})
+
+
+@app.post("/tasks/purge", response_model=schemas.Job, status_code=202)
+async def purge_tasks(db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+    return await jobs.enqueue_job(db, "purge_tasks", user.id, {})
+
+
+async def get_user_job_with_raise(db, job_id: int, user):
+    job = await jobs.get_job(db, job_id)
+
+    if not job or job.owner_id != user.id:
+        error_code = 404
+        error_json = {"error": {"message": f"Фоновая задача '{job_id}' не найдена", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+    return job
+
+
+@app.post("/jobs/{job_id}", response_model=schemas.Job)
+async def read_job(job_id: int, db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+    return await get_user_job_with_raise(db, job_id, user)
+
+
+@app.post("/jobs/{job_id}/cancel", response_model=schemas.Job)
+async def cancel_job(job_id: int, db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+    await get_user_job_with_raise(db, job_id, user)
+
+    return await jobs.cancel_job(db, job_id)
+
+
+# Операции /batch: op -> (функция, схема body, схема результата, нужен ли task_id)
+BATCH_OPERATIONS = {
+    "create_task": (
+        lambda db, user, task_id, body, commit: create_task_operation(db, user, body, commit=commit),
+        schemas.TaskCreate, schemas.Task, False
+    ),
+    "update_permissions": (
+        lambda db, user, task_id, body, commit: update_task_permissions_operation(db, user, task_id, body,
+                                                                                  commit=commit),
+        schemas.TaskPermissionUpdate, schemas.TaskPermission, True
+    ),
+    "read_task": (
+        lambda db, user, task_id, body, commit: read_task_operation(db, user.id, task_id),
+        None, schemas.Task, True
+    ),
+    "read_tasks": (
+        lambda db, user, task_id, body, commit: read_tasks_operation(db, user.id, body),
+        schemas.ReadTaskParams, List[schemas.Task], False
+    ),
+    "update_task": (
+        lambda db, user, task_id, body, commit: update_task_operation(db, user, task_id, body, commit=commit),
+        schemas.TaskBase, schemas.Task, True
+    ),
+    "delete_task": (
+        lambda db, user, task_id, body, commit: delete_task_operation(db, user, task_id, commit=commit),
+        None, None, True
+    ),
+    "move_task": (
+        lambda db, user, task_id, body, commit: move_task_operation(db, user, task_id, body, commit=commit),
+        schemas.TaskMove, schemas.Task, True
+    ),
+}
+MAX_BATCH_OPERATIONS = 100
+
+
+async def run_batch_operation(db: AsyncSession, user, operation: schemas.BatchOperation):
+    """
+    Выполняет одну операцию /batch без фиксации транзакции и возвращает её результат
+    """
+    handler, body_schema, response_schema, needs_task_id = BATCH_OPERATIONS[operation.op]
+
+    if needs_task_id and operation.task_id is None:
+        error_code = 422
+        error_json = {"error": {"message": f"Для операции '{operation.op}' нужен task_id", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    try:
+        body = body_schema.model_validate(operation.body or {}) if body_schema else None
+    except ValidationError as e:
+        error_code = 422
+        error_json = {"error": {"message": e.errors(include_url=False, include_context=False),
+                                "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    result = await handler(db, user, operation.task_id, body, False)
+
+    if response_schema is None:
+        return result
+    adapter = TypeAdapter(response_schema)
+    return adapter.dump_python(adapter.validate_python(result, from_attributes=True), mode="json")
+
+
+@app.post("/batch", response_model=schemas.BatchResponse)
+async def batch(batch_request: schemas.BatchRequest, db: AsyncSession = Depends(get_db), user=Depends(check_auth)):
+    """
+    Выполняет операции по порядку от имени одного пользователя в одной транзакции.
+    atomic=True - при первой ошибке откатываются все операции, оставшиеся не выполняются.
+    atomic=False - каждая операция выполняется в своей точке сохранения, ошибка откатывает только её
+    """
+    if len(batch_request.operations) > MAX_BATCH_OPERATIONS:
+        error_code = 400
+        error_json = {"error": {"message": f"Не больше {MAX_BATCH_OPERATIONS} операций в одном запросе",
+                                "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    results = []
+    failed = False
+
+    for operation in batch_request.operations:
+        if failed:
+            error_code = 424
+            results.append(schemas.BatchOperationResult(status_code=error_code, body={"error": {
+                "message": "Операция не выполнена из-за ошибки в предыдущей операции", "code": error_code}}))
+            continue
+
+        try:
+            if batch_request.atomic:
+                result = await run_batch_operation(db, user, operation)
+            else:
+                async with db.begin_nested():
+                    result = await run_batch_operation(db, user, operation)
+            results.append(schemas.BatchOperationResult(status_code=200, body=result))
+        except CustomHTTPException as e:
+            results.append(schemas.BatchOperationResult(status_code=e.status_code, body=e.content))
+            failed = batch_request.atomic
+        except IntegrityError as e:
+            error_code = 409
+            results.append(schemas.BatchOperationResult(status_code=error_code, body={"error": {
+                "message": str(e.orig), "code": error_code}}))
+            failed = batch_request.atomic
+
+    if failed:
+        await db.rollback()
+    else:
+        await db.commit()
+
+    return schemas.BatchResponse(committed=not failed, results=results)
+
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Готовность принимать запросы: БД отвечает и в пуле есть соединения
+    """
+    pool = database.engine.pool
+    pool_status = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": database.DB_MAX_OVERFLOW,
+    }
+
+    try:
+        await asyncio.wait_for(database.ping(), timeout=database.DB_PING_TIMEOUT)
+    except Exception as e:
+        error_code = 503
+        error_json = {"error": {"message": f"БД недоступна: {e!r}", "code": error_code}, "pool": pool_status}
+        raise CustomHTTPException(error_code, error_json)
+
+    return {"status": "ok", "pool": pool_status}
+
+
+@app.get("/metrics/task_cache")
+async def task_cache_metrics():
+    """
+    Статистика кэша задач текущего процесса
+    """
+    return task_cache.stats()
+
+
+async def check_admin(x_admin_token: str | None = Header(None)):
+    """
+    Доступ к служебным endpoint по заголовку X-Admin-Token (ADMIN_TOKEN в config, без него доступа нет)
+    """
+    admin_token = getattr(config, "ADMIN_TOKEN", None)
+
+    if not admin_token or not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        error_code = 403
+        error_json = {"error": {"message": "Нет доступа", "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+
+@app.post("/admin/profiling/settings", response_model=profiling.ProfilingSettings)
+async def update_profiling_settings(settings: profiling.ProfilingSettings, db: AsyncSession = Depends(get_db),
+                                    admin=Depends(check_admin)):
+    """
+    Включение/выключение профилирования во всех процессах приложения
+    """
+    await profiling.profiler.broadcast(db, settings)
+    await db.commit()
+
+    return profiling.profiler.settings
+
+
+@app.get("/admin/profiling/profiles")
+async def read_profiles(response: Response, admin=Depends(check_admin)):
+    """
+    Профили процесса, обработавшего запрос (его pid - в заголовке X-Worker-Pid)
+    """
+    response.headers["X-Worker-Pid"] = str(os.getpid())
+    return [profile.summary() for profile in reversed(profiling.profiler.profiles)]
+
+
+@app.get("/admin/profiling/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = "speedscope", admin=Depends(check_admin)):
+    profile = profiling.profiler.get(profile_id)
+
+    if not profile:
+        error_code = 404
+        message = f"Профиль '{profile_id}' не найден"
+        if not profile_id.startswith(f"{os.getpid()}-"):
+            message += f" (запрос обработан процессом {os.getpid()}, профиль снят другим процессом - повторите запрос)"
+        error_json = {"error": {"message": message, "code": error_code}}
+        raise CustomHTTPException(error_code, error_json)
+
+    interval_ms = profiling.profiler.settings.interval_ms
+
+    if format == "speedscope":
+        return Response(json.dumps(profiling.to_speedscope(profile, interval_ms)), media_type="application/json",
+                        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.speedscope.json"'})
+    if format == "pstats":
+        if not profile.stacks:
+            error_code = 409
+            error_json = {"error": {"message": f"В профиле '{profile_id}' нет стеков (запрос короче interval_ms)",
+                                    "code": error_code}}
+            raise CustomHTTPException(error_code, error_json)
+
+        return Response(profiling.to_pstats(profile, interval_ms), media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'})
+
+    error_code = 422
+    error_json = {"error": {"message": f"Неизвестный формат '{format}', доступны: speedscope, pstats",
+                            "code": error_code}}
+    raise CustomHTTPException(error_code, error_json)
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.35", port=8000)
+    from source.server import run
+    run()
@@ -0,0 +1,73 @@
+"""
+Служебные команды для денормализованных данных:
+    python -m source.maintenance check-visible-tasks [--user-id ID]
+    python -m source.maintenance rebuild-visible-tasks [--user-id ID]
+    python -m source.maintenance check-task-counters [--user-id ID]
+    python -m source.maintenance rebuild-task-counters [--user-id ID]
+"""
+import argparse
+import asyncio
+import json
+from source.crud import user_visible_tasks, task_counters
+import source.database as database
+
+
+async def check_visible_tasks(args):
+    async with database.SessionLocal() as db:
+        report = await user_visible_tasks.check_consistency(db, user_id=args.user_id)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if not report["missing"]["count"] and not report["extra"]["count"] else 1
+
+
+async def rebuild_visible_tasks(args):
+    async with database.SessionLocal() as db:
+        rows = await user_visible_tasks.rebuild(db, user_id=args.user_id)
+        # Счётчики вычисляются по user_visible_tasks, поэтому пересобираются вместе с ней
+        counter_rows = await task_counters.rebuild(db, user_id=args.user_id)
+        await db.commit()
+
+    print(f"user_visible_tasks: записано строк {rows}")
+    print(f"user_task_counters: записано строк {counter_rows}")
+    return 0
+
+
+async def check_task_counters(args):
+    async with database.SessionLocal() as db:
+        report = await task_counters.check_consistency(db, user_id=args.user_id)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if not report["count"] else 1
+
+
+async def rebuild_task_counters(args):
+    async with database.SessionLocal() as db:
+        rows = await task_counters.rebuild(db, user_id=args.user_id)
+        await db.commit()
+
+    print(f"user_task_counters: записано строк {rows}")
+    return 0
+
+
+COMMANDS = {
+    "check-visible-tasks": check_visible_tasks,
+    "rebuild-visible-tasks": rebuild_visible_tasks,
+    "check-task-counters": check_task_counters,
+    "rebuild-task-counters": rebuild_task_counters,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(prog="python -m source.maintenance", description="Служебные команды")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("--user-id", type=int, default=None, help="Только для одного пользователя")
+    args = parser.parse_args()
+
+    try:
+        return await COMMANDS[args.command](args)
+    finally:
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,162 @@
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция - модуль m<revision>_<name>.py с атрибутами:
+    REVISION - номер ревизии (по возрастанию)
+    TRANSACTIONAL - выполнять ли upgrade в транзакции
+        (False для операций вроде CREATE INDEX CONCURRENTLY)
+    async def upgrade(conn) - применение миграции
+    MIN_APP_REVISION - необязательный: минимальная ревизия приложения (HEAD_REVISION его кода),
+        которая правильно работает со схемой после миграции. Задаётся, если процессы прежней версии
+        сломали бы данные новой схемы (например, не поддерживали бы заполненную миграцией таблицу)
+
+Миграции не импортируют модели и crud: DDL и SQL ревизии записаны в ней самой.
+
+Совместимость при обновлении: приложение запускается, если схема не старее его ревизии и
+его ревизия не меньше MIN_APP_REVISION всех применённых миграций (хранится в schema_revision,
+поэтому её видят и версии приложения, не знающие о новых миграциях). Миграция с MIN_APP_REVISION
+больше требуемой сейчас применяется только с stop_the_world=True (python -m source.migrations upgrade
+--stop-the-world): до этого все процессы приложения должны быть остановлены, иначе работающие процессы
+прежней версии продолжат писать данные по старым правилам. На пустой БД это не требуется.
+
+Применение: python -m source.migrations upgrade
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from source.migrations import (m0001_initial, m0002_concurrent_indexes, m0003_user_visible_tasks,
+                               m0004_user_task_counters, m0005_jobs, m0006_subtasks,
+                               m0007_task_bodies, m0008_user_list_versions, m0009_visible_task_owner,
+                               m0010_orphan_permissions)
+
+
+MIGRATIONS = [
+    m0001_initial,
+    m0002_concurrent_indexes,
+    m0003_user_visible_tasks,
+    m0004_user_task_counters,
+    m0005_jobs,
+    m0006_subtasks,
+    m0007_task_bodies,
+    m0008_user_list_versions,
+    m0009_visible_task_owner,
+    m0010_orphan_permissions,
+]
+
+HEAD_REVISION = MIGRATIONS[-1].REVISION
+
+# Ключ pg_advisory_lock, чтобы несколько процессов не применяли миграции одновременно
+MIGRATIONS_LOCK_KEY = 7_462_001
+
+
+class SchemaRevisionError(RuntimeError):
+    pass
+
+
+async def get_current_revision(conn) -> int:
+    """
+    Возвращает текущую ревизию схемы (0, если миграции ещё не применялись)
+    """
+    exists = await conn.scalar(text("SELECT to_regclass('schema_revision') IS NOT NULL"))
+    if not exists:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(revision), 0) FROM schema_revision"))
+
+
+async def get_min_app_revision(conn) -> int:
+    """
+    Минимальная ревизия приложения, совместимая с применёнными миграциями (0 - любая)
+    """
+    exists = await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'schema_revision' AND column_name = 'min_app_revision')"
+    ))
+    if not exists:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(min_app_revision), 0) FROM schema_revision"))
+
+
+async def check_schema_revision(engine: AsyncEngine):
+    """
+    Быстрая проверка при старте приложения: схема БД должна быть не старее последней известной ревизии.
+    Более новая схема допустима, если ни одна из применённых миграций не требует более новой версии приложения
+    """
+    async with engine.connect() as conn:
+        current = await get_current_revision(conn)
+        min_app_revision = await get_min_app_revision(conn)
+
+    if current < HEAD_REVISION:
+        raise SchemaRevisionError(f"Ревизия схемы БД {current}, ожидается не меньше {HEAD_REVISION}. "
+                                  f"Примените миграции: python -m source.migrations upgrade")
+
+    if HEAD_REVISION < min_app_revision:
+        raise SchemaRevisionError(f"Схема БД ревизии {current} несовместима с этой версией приложения "
+                                  f"(ревизия {HEAD_REVISION}, нужна не меньше {min_app_revision})")
+
+
+def check_online_upgrade(current: int, min_app_revision: int, target: int):
+    """
+    Отказ, если среди миграций до target есть такие, которые нельзя применять при работающих
+    процессах прежней версии приложения (ревизии не меньше min_app_revision)
+    """
+    for migration in MIGRATIONS:
+        if current < migration.REVISION <= target and getattr(migration, "MIN_APP_REVISION", 0) > min_app_revision:
+            raise SchemaRevisionError(
+                f"Миграция {migration.__name__} (ревизия {migration.REVISION}) несовместима с работающими "
+                f"процессами приложения ревизии меньше {migration.MIN_APP_REVISION}. Остановите все процессы "
+                f"приложения и повторите с --stop-the-world"
+            )
+
+
+async def upgrade(engine: AsyncEngine, target: int = HEAD_REVISION, stop_the_world: bool = False, log=print):
+    """
+    Применяет все миграции с ревизией больше текущей и не больше target.
+    stop_the_world=True - процессы приложения остановлены, несовместимые с ними миграции разрешены
+    """
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+
+        try:
+            await lock_conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_revision ("
+                "revision integer PRIMARY KEY, "
+                "applied_at timestamptz NOT NULL DEFAULT now())"
+            ))
+            await lock_conn.execute(text(
+                "ALTER TABLE schema_revision ADD COLUMN IF NOT EXISTS min_app_revision integer NOT NULL DEFAULT 0"
+            ))
+            current = await get_current_revision(lock_conn)
+
+            # На пустой БД работающих с ней процессов нет
+            empty = current == 0 and not await lock_conn.scalar(text("SELECT to_regclass('users') IS NOT NULL"))
+            if not stop_the_world and not empty:
+                check_online_upgrade(current, await get_min_app_revision(lock_conn), target)
+
+            for migration in MIGRATIONS:
+                if not current < migration.REVISION <= target:
+                    continue
+
+                log(f"Применение миграции {migration.__name__} (ревизия {migration.REVISION})")
+
+                if migration.TRANSACTIONAL:
+                    async with engine.begin() as conn:
+                        await migration.upgrade(conn)
+                        await set_revision(conn, migration)
+                else:
+                    async with engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await migration.upgrade(conn)
+                        await set_revision(conn, migration)
+
+                current = migration.REVISION
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+
+    return current
+
+
+async def set_revision(conn, migration):
+    await conn.execute(text("INSERT INTO schema_revision (revision, min_app_revision) "
+                            "VALUES (:revision, :min_app_revision)"),
+                       {"revision": migration.REVISION,
+                        "min_app_revision": getattr(migration, "MIN_APP_REVISION", 0)})
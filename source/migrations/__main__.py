@@ -0,0 +1,34 @@
+import argparse
+import asyncio
+from source import migrations
+import source.database as database
+
+
+async def main():
+    parser = argparse.ArgumentParser(prog="python -m source.migrations", description="Миграции схемы БД")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    upgrade_parser = subparsers.add_parser("upgrade", help="Применить миграции")
+    upgrade_parser.add_argument("--target", type=int, default=migrations.HEAD_REVISION,
+                                help="Ревизия, до которой применять миграции")
+    upgrade_parser.add_argument("--stop-the-world", action="store_true",
+                                help="Все процессы приложения остановлены: разрешить несовместимые с ними миграции")
+    subparsers.add_parser("current", help="Показать текущую ревизию")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "upgrade":
+            revision = await migrations.upgrade(database.engine, target=args.target,
+                                                stop_the_world=args.stop_the_world)
+            print(f"Ревизия схемы: {revision}")
+        elif args.command == "current":
+            async with database.engine.connect() as conn:
+                revision = await migrations.get_current_revision(conn)
+            print(f"Ревизия схемы: {revision} (последняя: {migrations.HEAD_REVISION})")
+    finally:
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Начальная схема: users, tasks, task_permissions.
+Уже существующие таблицы (созданные раньше через create_all) не пересоздаются
+"""
+from sqlalchemy import text
+from source.migrations.operations import TASK_PARTITIONS, partition_by, create_hash_partitions
+
+
+REVISION = 1
+TRANSACTIONAL = True
+
+
+def get_tables():
+    """
+    {таблица: DDL таблицы и её индексов} в порядке создания
+    """
+    # В секционированной таблице ключ секционирования входит в первичный ключ, а внешних ключей на tasks.id нет
+    tasks_key = "id, owner_id" if TASK_PARTITIONS else "id"
+    permissions_key = "id, user_id" if TASK_PARTITIONS else "id"
+    permissions_task_fk = "" if TASK_PARTITIONS else ", FOREIGN KEY (task_id) REFERENCES tasks (id)"
+    not_null = " NOT NULL" if TASK_PARTITIONS else ""
+
+    return {
+        "users": [
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id SERIAL NOT NULL, username VARCHAR, hashed_password VARCHAR, "
+            "PRIMARY KEY (id))",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+            "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+        ],
+        "tasks": [
+            f"CREATE TABLE IF NOT EXISTS tasks ("
+            f"id SERIAL NOT NULL, title VARCHAR, description VARCHAR, owner_id INTEGER{not_null}, "
+            f"PRIMARY KEY ({tasks_key}), FOREIGN KEY (owner_id) REFERENCES users (id))"
+            f"{partition_by('owner_id')}",
+            "CREATE INDEX IF NOT EXISTS ix_tasks_id ON tasks (id)",
+            "CREATE INDEX IF NOT EXISTS ix_tasks_title ON tasks (title)",
+            "CREATE INDEX IF NOT EXISTS ix_tasks_description ON tasks (description)",
+            "CREATE INDEX IF NOT EXISTS ix_tasks_owner_id ON tasks (owner_id)",
+        ],
+        "task_permissions": [
+            f"CREATE TABLE IF NOT EXISTS task_permissions ("
+            f"id SERIAL NOT NULL, task_id INTEGER, user_id INTEGER{not_null}, can_read BOOLEAN, can_update BOOLEAN, "
+            f"PRIMARY KEY ({permissions_key}), CONSTRAINT uix_task_user UNIQUE (task_id, user_id)"
+            f"{permissions_task_fk}, FOREIGN KEY (user_id) REFERENCES users (id))"
+            f"{partition_by('user_id')}",
+            "CREATE INDEX IF NOT EXISTS ix_task_permissions_id ON task_permissions (id)",
+            "CREATE INDEX IF NOT EXISTS ix_task_permissions_user_id ON task_permissions (user_id)",
+        ],
+    }
+
+
+async def upgrade(conn):
+    for table, statements in get_tables().items():
+        # Индексы существующей таблицы не создаются: на большой таблице это долгая блокировка,
+        # недостающие индексы строятся CONCURRENTLY в m0002
+        if await conn.scalar(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": table}):
+            continue
+
+        for sql in statements:
+            await conn.execute(text(sql))
+
+        if table != "users":
+            await create_hash_partitions(conn, table)
@@ -0,0 +1,14 @@
+"""
+Индексы для выборки задач владельца и прав пользователя
+(в БД, созданных до появления миграций, их нет)
+"""
+from source.migrations.operations import create_index_concurrently
+
+
+REVISION = 2
+TRANSACTIONAL = False
+
+
+async def upgrade(conn):
+    await create_index_concurrently(conn, "ix_tasks_owner_id", "tasks", "owner_id")
+    await create_index_concurrently(conn, "ix_task_permissions_user_id", "task_permissions", "user_id")
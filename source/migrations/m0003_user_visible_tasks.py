@@ -0,0 +1,41 @@
+"""
+Таблица user_visible_tasks и её заполнение по tasks и task_permissions
+"""
+from sqlalchemy import text
+from source.migrations.operations import TASK_PARTITIONS, partition_by, create_hash_partitions
+
+
+REVISION = 3
+TRANSACTIONAL = True
+# Прежняя версия приложения не поддерживает user_visible_tasks: её задачи пропали бы из списков
+MIN_APP_REVISION = 3
+
+# Содержимое user_visible_tasks по схеме ревизии 3 (владелец видит свою задачу всегда, остальные - при can_read)
+FILL_SQL = """
+    INSERT INTO user_visible_tasks (user_id, task_id, can_update)
+    SELECT t.owner_id, t.id, coalesce(p.can_update, false)
+    FROM tasks t
+    LEFT JOIN task_permissions p ON p.task_id = t.id AND p.user_id = t.owner_id
+    WHERE t.owner_id IS NOT NULL
+    UNION ALL
+    SELECT p.user_id, p.task_id, coalesce(p.can_update, false)
+    FROM task_permissions p
+    JOIN tasks t ON t.id = p.task_id
+    WHERE p.can_read AND p.user_id <> t.owner_id
+"""
+
+
+async def upgrade(conn):
+    task_fk = "" if TASK_PARTITIONS else ", FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE"
+
+    await conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS user_visible_tasks ("
+        f"user_id INTEGER NOT NULL, task_id INTEGER NOT NULL, can_update BOOLEAN NOT NULL, "
+        f"PRIMARY KEY (user_id, task_id), FOREIGN KEY (user_id) REFERENCES users (id){task_fk})"
+        f"{partition_by('user_id')}"
+    ))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_user_visible_tasks_task_id ON user_visible_tasks (task_id)"))
+    await create_hash_partitions(conn, "user_visible_tasks")
+
+    await conn.execute(text("DELETE FROM user_visible_tasks"))
+    await conn.execute(text(FILL_SQL))
@@ -0,0 +1,33 @@
+"""
+Счётчики задач пользователей для /tasks/summary и их заполнение по user_visible_tasks
+"""
+from sqlalchemy import text
+
+
+REVISION = 4
+TRANSACTIONAL = True
+# Прежняя версия приложения не изменяет счётчики: /tasks/summary разошёлся бы с задачами
+MIN_APP_REVISION = 4
+
+STATEMENTS = [
+    "CREATE TABLE IF NOT EXISTS user_task_counters ("
+    "user_id INTEGER NOT NULL, owned INTEGER DEFAULT '0' NOT NULL, shared INTEGER DEFAULT '0' NOT NULL, "
+    "PRIMARY KEY (user_id), FOREIGN KEY (user_id) REFERENCES users (id))",
+
+    "DELETE FROM user_task_counters",
+
+    """
+    INSERT INTO user_task_counters (user_id, owned, shared)
+    SELECT v.user_id,
+           count(*) FILTER (WHERE t.owner_id = v.user_id),
+           count(*) FILTER (WHERE t.owner_id <> v.user_id)
+    FROM user_visible_tasks v
+    JOIN tasks t ON t.id = v.task_id
+    GROUP BY v.user_id
+    """,
+]
+
+
+async def upgrade(conn):
+    for sql in STATEMENTS:
+        await conn.execute(text(sql))
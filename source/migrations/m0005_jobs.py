@@ -0,0 +1,36 @@
+"""
+Таблица фоновых задач jobs
+"""
+from sqlalchemy import text
+
+
+REVISION = 5
+TRANSACTIONAL = True
+
+STATEMENTS = [
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    "id SERIAL NOT NULL, "
+    "kind VARCHAR NOT NULL, "
+    "owner_id INTEGER, "
+    "status VARCHAR DEFAULT 'queued' NOT NULL, "
+    "params JSONB NOT NULL, "
+    "progress INTEGER DEFAULT '0' NOT NULL, "
+    "total INTEGER, "
+    "result JSONB, "
+    "error VARCHAR, "
+    "cancel_requested BOOLEAN DEFAULT 'false' NOT NULL, "
+    "attempts INTEGER DEFAULT '0' NOT NULL, "
+    "created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL, "
+    "updated_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL, "
+    "heartbeat_at TIMESTAMP WITH TIME ZONE, "
+    "PRIMARY KEY (id), FOREIGN KEY (owner_id) REFERENCES users (id))",
+
+    "CREATE INDEX IF NOT EXISTS ix_jobs_id ON jobs (id)",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_owner_id ON jobs (owner_id)",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_pending ON jobs (status, id) WHERE status IN ('queued', 'running')",
+]
+
+
+async def upgrade(conn):
+    for sql in STATEMENTS:
+        await conn.execute(text(sql))
@@ -0,0 +1,20 @@
+"""
+Подзадачи: tasks.parent_id (родитель) и tasks.root_id (корневая задача дерева, NULL у корневых).
+С этой ревизии в user_visible_tasks и user_task_counters учитываются только корневые задачи.
+Пересборка не нужна: до этой ревизии parent_id нет, все задачи корневые, и m0003/m0004 заполнили
+таблицы так же
+"""
+from sqlalchemy import text
+from source.migrations.operations import TASK_PARTITIONS, create_index_concurrently
+
+
+REVISION = 6
+TRANSACTIONAL = False
+
+
+async def upgrade(conn):
+    references = "" if TASK_PARTITIONS else " REFERENCES tasks (id)"
+    await conn.execute(text(f"ALTER TABLE tasks ADD COLUMN IF NOT EXISTS parent_id integer{references}"))
+    await conn.execute(text("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS root_id integer"))
+    await create_index_concurrently(conn, "ix_tasks_parent_id", "tasks", "parent_id")
+    await create_index_concurrently(conn, "ix_tasks_root_id", "tasks", "root_id")
@@ -0,0 +1,76 @@
+"""
+Длинные описания задач в task_bodies: в tasks.description остаётся превью.
+Индекс по tasks.description удаляется - для длинных описаний B-tree индекс не годится
+(строка индекса ограничена ~2.7 КБ), а поиска по описанию нет
+"""
+import zlib
+from sqlalchemy import text, bindparam, LargeBinary
+from source.migrations.operations import TASK_PARTITIONS, partition_by, create_hash_partitions, drop_index_concurrently
+from secret_data import config
+
+
+REVISION = 7
+TRANSACTIONAL = False
+# Прежняя версия приложения отдавала бы превью как полный текст, а её update_task записывал бы полный текст
+# в tasks.description, оставляя description_truncated и устаревшие части в task_bodies
+MIN_APP_REVISION = 7
+
+# Формат task_bodies ревизии 7: части по BODY_CHUNK_SIZE байт UTF-8, каждая сжата zlib.
+# Длина превью - настройка установки, как и в crud/task_bodies.py
+DESCRIPTION_PREVIEW_LENGTH = getattr(config, "DESCRIPTION_PREVIEW_LENGTH", 500)
+BODY_CHUNK_SIZE = 64 * 1024
+COMPRESSION_LEVEL = 6
+
+# Сколько задач переносится за один шаг (каждый запрос в режиме AUTOCOMMIT коммитится сам,
+# повторный запуск продолжит с ещё не перенесённых задач)
+BATCH_SIZE = 100
+
+INSERT_CHUNK_SQL = text(
+    "INSERT INTO task_bodies (task_id, chunk_no, size, data) VALUES (:task_id, :chunk_no, :size, :data)"
+).bindparams(bindparam("data", type_=LargeBinary))
+
+
+async def move_body(conn, task_id: int, description: str):
+    raw = description.encode()
+
+    await conn.execute(text("DELETE FROM task_bodies WHERE task_id = :task_id"), {"task_id": task_id})
+    await conn.execute(INSERT_CHUNK_SQL, [
+        {
+            "task_id": task_id,
+            "chunk_no": chunk_no,
+            "size": len(raw[start:start + BODY_CHUNK_SIZE]),
+            "data": zlib.compress(raw[start:start + BODY_CHUNK_SIZE], COMPRESSION_LEVEL),
+        }
+        for chunk_no, start in enumerate(range(0, len(raw), BODY_CHUNK_SIZE))
+    ])
+    await conn.execute(text("UPDATE tasks SET description = :preview, description_truncated = true "
+                            "WHERE id = :task_id"),
+                       {"preview": description[:DESCRIPTION_PREVIEW_LENGTH], "task_id": task_id})
+
+
+async def upgrade(conn):
+    task_fk = "" if TASK_PARTITIONS else ", FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE"
+
+    await conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS task_bodies ("
+        f"task_id INTEGER NOT NULL, chunk_no INTEGER NOT NULL, size INTEGER NOT NULL, data BYTEA NOT NULL, "
+        f"PRIMARY KEY (task_id, chunk_no){task_fk})"
+        f"{partition_by('task_id')}"
+    ))
+    await create_hash_partitions(conn, "task_bodies")
+    await conn.execute(text("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS description_truncated boolean "
+                            "NOT NULL DEFAULT false"))
+    await drop_index_concurrently(conn, "ix_tasks_description")
+
+    while True:
+        result = await conn.execute(text(
+            "SELECT id, description FROM tasks WHERE NOT description_truncated AND length(description) > :length "
+            "ORDER BY id LIMIT :limit"
+        ), {"length": DESCRIPTION_PREVIEW_LENGTH, "limit": BATCH_SIZE})
+        rows = result.all()
+
+        if not rows:
+            break
+
+        for task_id, description in rows:
+            await move_body(conn, task_id, description)
@@ -0,0 +1,18 @@
+"""
+Таблица user_list_versions (ETag списков). Заполнять не нужно: нет строки - счётчик 0
+"""
+from sqlalchemy import text
+
+
+REVISION = 8
+TRANSACTIONAL = True
+# Прежняя версия приложения не увеличивает счётчики: новые процессы отвечали бы 304 на изменившиеся списки
+MIN_APP_REVISION = 8
+
+
+async def upgrade(conn):
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS user_list_versions ("
+        "user_id INTEGER NOT NULL, version BIGINT DEFAULT '1' NOT NULL, "
+        "PRIMARY KEY (user_id), FOREIGN KEY (user_id) REFERENCES users (id))"
+    ))
@@ -0,0 +1,63 @@
+"""
+user_visible_tasks.owner_id - владелец задачи, чтобы выборка задач пользователя соединялась с tasks
+по (owner_id, id) и читала только секцию владельца.
+
+При постепенном обновлении прежняя версия приложения ещё вставляет строки без owner_id, поэтому
+столбец NULL-допустимый, а триггер BEFORE INSERT берёт owner_id из tasks. Триггер можно будет
+удалить (и сделать столбец NOT NULL) в ревизии, которая и так требует остановки всех процессов.
+Для секционированной user_visible_tasks нужен PostgreSQL 13+ (BEFORE-триггеры секционированных таблиц).
+
+Существующие строки заполняются частями по BACKFILL_BATCH_SIZE, каждая часть - в своей транзакции,
+чтобы не блокировать таблицу на всё время заполнения
+"""
+from sqlalchemy import text
+
+
+REVISION = 9
+TRANSACTIONAL = False
+
+BACKFILL_BATCH_SIZE = 10_000
+
+STATEMENTS = [
+    "ALTER TABLE user_visible_tasks ADD COLUMN IF NOT EXISTS owner_id integer",
+
+    """
+    CREATE OR REPLACE FUNCTION user_visible_tasks_fill_owner_id() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.owner_id IS NULL THEN
+            SELECT owner_id INTO NEW.owner_id FROM tasks WHERE id = NEW.task_id;
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+
+    "DROP TRIGGER IF EXISTS user_visible_tasks_fill_owner_id ON user_visible_tasks",
+
+    "CREATE TRIGGER user_visible_tasks_fill_owner_id BEFORE INSERT ON user_visible_tasks "
+    "FOR EACH ROW EXECUTE FUNCTION user_visible_tasks_fill_owner_id()",
+]
+
+# Строки без задачи в tasks в выборку не попадают, иначе цикл не закончится
+BACKFILL_SQL = """
+    UPDATE user_visible_tasks v SET owner_id = t.owner_id
+    FROM tasks t
+    WHERE t.id = v.task_id AND (v.user_id, v.task_id) IN (
+        SELECT b.user_id, b.task_id
+        FROM user_visible_tasks b
+        JOIN tasks bt ON bt.id = b.task_id
+        WHERE b.owner_id IS NULL
+        LIMIT :batch_size
+    )
+"""
+
+
+async def upgrade(conn):
+    # conn в режиме AUTOCOMMIT: каждая команда - отдельная транзакция
+    for sql in STATEMENTS:
+        await conn.execute(text(sql))
+
+    while True:
+        result = await conn.execute(text(BACKFILL_SQL), {"batch_size": BACKFILL_BATCH_SIZE})
+        if not result.rowcount:
+            break
@@ -0,0 +1,19 @@
+"""
+Удаление строк task_permissions, оставшихся от удалённых задач: прежние версии при удалении задачи
+не удаляли её права, а обнуляли в них task_id, и /users/check_token_auth у пользователей с такими
+правами отвечал 500
+"""
+from sqlalchemy import text
+
+
+REVISION = 10
+TRANSACTIONAL = True
+# Прежняя версия приложения продолжала бы оставлять такие строки после очистки
+MIN_APP_REVISION = 10
+
+
+async def upgrade(conn):
+    await conn.execute(text(
+        "DELETE FROM task_permissions WHERE task_id IS NULL "
+        "OR NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.id = task_permissions.task_id)"
+    ))
@@ -0,0 +1,59 @@
+"""
+Операции для миграций, которые можно выполнять на работающей БД без долгих блокировок,
+и DDL секционирования
+"""
+from sqlalchemy import text
+from secret_data import config
+
+
+# Настройка установки, а не схемы: секционирование выбирается при создании таблиц
+TASK_PARTITIONS = getattr(config, "TASK_PARTITIONS", 0)
+
+
+def partition_by(partition_key: str):
+    """
+    Окончание CREATE TABLE для таблицы, секционированной по hash(partition_key), если секционирование включено
+    """
+    return f" PARTITION BY HASH ({partition_key})" if TASK_PARTITIONS else ""
+
+
+async def create_hash_partitions(conn, table: str):
+    for remainder in range(TASK_PARTITIONS):
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {table}_p{remainder} PARTITION OF {table} "
+            f"FOR VALUES WITH (MODULUS {TASK_PARTITIONS}, REMAINDER {remainder})"
+        ))
+
+
+async def create_index_concurrently(conn, name: str, table: str, columns: str, unique: bool = False):
+    """
+    CREATE INDEX CONCURRENTLY вне транзакции (conn должен быть в режиме AUTOCOMMIT).
+    Невалидный индекс, оставшийся после прерванной попытки, пересоздаётся.
+    Для секционированных таблиц CONCURRENTLY не поддерживается, поэтому индекс создаётся обычным образом
+    """
+    index_valid = await conn.scalar(text(
+        "SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(:name)"
+    ), {"name": name})
+
+    if index_valid:
+        return
+
+    if index_valid is False:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    relkind = await conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+                                {"table": table})
+    concurrently = "" if relkind == "p" else "CONCURRENTLY "
+    unique_sql = "UNIQUE " if unique else ""
+
+    await conn.execute(text(f"CREATE {unique_sql}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+async def drop_index_concurrently(conn, name: str):
+    """
+    DROP INDEX CONCURRENTLY вне транзакции. Индекс секционированной таблицы удаляется обычным образом
+    """
+    relkind = await conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name})
+    concurrently = "" if relkind == "I" else "CONCURRENTLY "
+
+    await conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
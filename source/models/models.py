@@ -1,24 +1,57 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, UniqueConstraint
+from sqlalchemy import (Column, Integer, String, ForeignKey, Boolean, UniqueConstraint, Index, DDL, DateTime, event,
+                        func, LargeBinary, BigInteger)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, relationship
+from secret_data import config
+
+
+# Количество hash-секций для tasks (по owner_id) и task_permissions (по user_id).
+# 0 - обычные таблицы без секционирования
+TASK_PARTITIONS = getattr(config, "TASK_PARTITIONS", 0)
 
 
 class Base(DeclarativeBase):
     pass
 
 
+def partition_table_args(partition_key: str, *args):
+    """
+    Возвращает __table_args__ для таблицы, секционированной по hash(partition_key),
+    если секционирование включено (TASK_PARTITIONS > 0)
+    """
+    if not TASK_PARTITIONS:
+        return args
+    return args + ({"postgresql_partition_by": f"HASH ({partition_key})"},)
+
+
+def create_hash_partitions(table, partitions: int = TASK_PARTITIONS):
+    """
+    Создаёт секции <table>_p0 ... <table>_p{partitions - 1} сразу после создания родительской таблицы
+    """
+    for remainder in range(partitions):
+        event.listen(table, "after_create", DDL(
+            f"CREATE TABLE IF NOT EXISTS {table.name}_p{remainder} PARTITION OF {table.name} "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        ))
+
+
 class TaskPermission(Base):
     __tablename__ = "task_permissions"
-    id = Column(Integer, primary_key=True, index=True)
-    task_id = Column(Integer, ForeignKey("tasks.id"))
-    user_id = Column(Integer, ForeignKey("users.id"))
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    # В секционированной таблице tasks нет уникального индекса по одному id (ключ секционирования
+    # обязан входить в первичный ключ), поэтому внешний ключ на tasks.id проверяет приложение
+    task_id = Column(Integer, *([ForeignKey("tasks.id")] if not TASK_PARTITIONS else []))
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=bool(TASK_PARTITIONS), index=True)
     can_read = Column(Boolean, default=False)
     can_update = Column(Boolean, default=False)
 
-    task = relationship("Task", back_populates="permissions", lazy="selectin")
+    task = relationship("Task", back_populates="permissions", lazy="selectin",
+                        primaryjoin="TaskPermission.task_id == Task.id",
+                        foreign_keys="TaskPermission.task_id")
     user = relationship("User", back_populates="permissions", lazy="selectin")
 
     # uix - unique index on task_id and user_id
-    __table_args__ = (UniqueConstraint('task_id', 'user_id', name='uix_task_user'),)
+    __table_args__ = partition_table_args("user_id", UniqueConstraint('task_id', 'user_id', name='uix_task_user'))
 
     def __repr__(self):
         return (f"<TaskPermission(task_id='{self.task_id}', user_id='{self.user_id}, can_read='{self.can_read}'"
@@ -40,13 +73,127 @@ class User(Base):
 
 class Task(Base):
     __tablename__ = "tasks"
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     title = Column(String, index=True)
-    description = Column(String, index=True)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    # Начало описания (превью для списков). Полный текст длинного описания - в task_bodies
+    description = Column(String)
+    description_truncated = Column(Boolean, nullable=False, default=False, server_default="false")
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=bool(TASK_PARTITIONS), index=True)
+    # Подзадачи: parent_id - родительская задача, root_id - корневая задача дерева (NULL у самой корневой).
+    # Права задаются только на корневые задачи и действуют на всё дерево
+    parent_id = Column(Integer, *([ForeignKey("tasks.id")] if not TASK_PARTITIONS else []), index=True)
+    root_id = Column(Integer, index=True)
 
     owner = relationship("User", back_populates="tasks", lazy="selectin")
-    permissions = relationship("TaskPermission", back_populates="task", lazy="selectin")
+    # Строки task_permissions удаляет crud/user_tasks.delete_task, при удалении задачи ORM их не трогает
+    permissions = relationship("TaskPermission", back_populates="task", lazy="selectin",
+                               primaryjoin="TaskPermission.task_id == Task.id",
+                               foreign_keys="TaskPermission.task_id", passive_deletes="all")
+
+    __table_args__ = partition_table_args("owner_id")
+
+    def __repr__(self):
+        return (f"<Task(id='{self.id}', title='{self.title}', description='{self.description}', owner_id='{self.owner_id}'"
+                f", parent_id='{self.parent_id}')>")
+
+
+class TaskBody(Base):
+    """
+    Полный текст длинного описания задачи: UTF-8, разбитый на части по BODY_CHUNK_SIZE байт,
+    каждая сжата zlib (crud/task_bodies.py). Части позволяют читать диапазон, не распаковывая всё описание
+    """
+    __tablename__ = "task_bodies"
+    task_id = Column(Integer, *([ForeignKey("tasks.id", ondelete="CASCADE")] if not TASK_PARTITIONS else []),
+                     primary_key=True)
+    chunk_no = Column(Integer, primary_key=True)
+    size = Column(Integer, nullable=False)  # Размер части до сжатия, байт
+    data = Column(LargeBinary, nullable=False)
+
+    __table_args__ = partition_table_args("task_id")
+
+    def __repr__(self):
+        return f"<TaskBody(task_id='{self.task_id}', chunk_no='{self.chunk_no}', size='{self.size}')>"
+
+
+class UserVisibleTask(Base):
+    """
+    Денормализованный список задач, видимых пользователю (свои задачи и задачи с can_read).
+    Поддерживается в crud/user_tasks.py в тех же транзакциях, что и tasks/task_permissions,
+    чтобы выборка и подсчёт задач пользователя были одним проходом по первичному ключу
+    """
+    __tablename__ = "user_visible_tasks"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    task_id = Column(Integer, *([ForeignKey("tasks.id", ondelete="CASCADE")] if not TASK_PARTITIONS else []),
+                     primary_key=True)
+    # Владелец задачи: соединение с tasks по (owner_id, id) читает одну секцию tasks.
+    # NULL-допустимый, как в миграции m0009: строки прежней версии приложения заполняет триггер
+    owner_id = Column(Integer)
+    can_update = Column(Boolean, default=False, nullable=False)
+
+    __table_args__ = partition_table_args("user_id", Index("ix_user_visible_tasks_task_id", "task_id"))
+
+    def __repr__(self):
+        return (f"<UserVisibleTask(user_id='{self.user_id}', task_id='{self.task_id}', owner_id='{self.owner_id}'"
+                f", can_update='{self.can_update}')>")
+
+
+class UserTaskCounters(Base):
+    """
+    Количество задач пользователя: owned - созданные им, shared - выданные ему другими (видимые, не свои).
+    Изменяется вместе с user_visible_tasks (crud/task_counters.py)
+    """
+    __tablename__ = "user_task_counters"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    owned = Column(Integer, default=0, server_default="0", nullable=False)
+    shared = Column(Integer, default=0, server_default="0", nullable=False)
+
+    def __repr__(self):
+        return f"<UserTaskCounters(user_id='{self.user_id}', owned='{self.owned}', shared='{self.shared}')>"
+
+
+class UserListVersion(Base):
+    """
+    Счётчик изменений данных, которые пользователь видит в списках (/tasks/read_tasks, /users/check_token_auth).
+    Увеличивается в тех же транзакциях, что и изменения (crud/list_versions.py), и служит для ETag этих ответов
+    """
+    __tablename__ = "user_list_versions"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(BigInteger, default=1, server_default="1", nullable=False)
 
     def __repr__(self):
-        return f"<Task(id='{self.id}', title='{self.title}', description='{self.description}', owner_id='{self.owner_id}')>"
+        return f"<UserListVersion(user_id='{self.user_id}', version='{self.version}')>"
+
+
+class Job(Base):
+    """
+    Фоновая задача (source/jobs.py). status: queued, running, succeeded, failed, cancelled
+    """
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, nullable=False, default="queued", server_default="queued")
+    params = Column(JSONB, nullable=False, default=dict)
+    progress = Column(Integer, nullable=False, default=0, server_default="0")
+    total = Column(Integer)
+    result = Column(JSONB)
+    error = Column(String)
+    cancel_requested = Column(Boolean, nullable=False, default=False, server_default="false")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    heartbeat_at = Column(DateTime(timezone=True))
+
+    # Поиск задач для выполнения: только queued/running, поэтому индекс частичный
+    __table_args__ = (Index("ix_jobs_pending", "status", "id",
+                            postgresql_where=status.in_(["queued", "running"])),)
+
+    def __repr__(self):
+        return f"<Job(id='{self.id}', kind='{self.kind}', status='{self.status}', progress='{self.progress}')>"
+
+
+if TASK_PARTITIONS:
+    create_hash_partitions(TaskPermission.__table__)
+    create_hash_partitions(Task.__table__)
+    create_hash_partitions(UserVisibleTask.__table__)
+    create_hash_partitions(TaskBody.__table__)
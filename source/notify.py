@@ -0,0 +1,124 @@
+"""
+LISTEN PostgreSQL на отдельном соединении с переподключением.
+
+Соединение держится открытым до stop. Потеря соединения обнаруживается по сигналу asyncpg
+(add_termination_listener) и проверочным запросом раз в LISTENER_CHECK_INTERVAL секунд (обрыв без
+закрытия сокета), после чего соединение открывается заново с паузой, растущей до LISTENER_RETRY_MAX.
+Уведомления, отправленные, пока соединения не было, теряются, поэтому после переподключения
+вызывается on_reconnect
+"""
+import asyncio
+import logging
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+LISTENER_CHECK_INTERVAL = 30  # Секунды
+LISTENER_RETRY_MIN = 0.5
+LISTENER_RETRY_MAX = 30
+
+logger = logging.getLogger(__name__)
+
+
+class NotifyListener:
+    def __init__(self, channels: dict, on_reconnect=None):
+        """
+        channels - {канал: callback(payload)}, callback вызывается в event loop и не должен блокировать
+        """
+        self.channels = channels
+        self.on_reconnect = on_reconnect
+        self.reconnects = 0
+
+        self._engine = None
+        self._conn = None
+        self._driver_connection = None
+        self._terminated = None
+        self._watcher = None
+
+    @property
+    def connected(self):
+        return self._conn is not None
+
+    async def start(self, engine: AsyncEngine):
+        """
+        Первое подключение - сразу: ошибка при старте приложения не скрывается
+        """
+        self._engine = engine
+        await self._connect()
+        self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+        await self._close()
+
+    def _on_notification(self, connection, pid, channel, payload):
+        self.channels[channel](payload)
+
+    def _on_termination(self, connection):
+        self._terminated.set()
+
+    async def _connect(self):
+        conn = await self._engine.connect()
+        try:
+            raw_connection = await conn.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+
+            self._terminated = asyncio.Event()
+            driver_connection.add_termination_listener(self._on_termination)
+            for channel in self.channels:
+                await driver_connection.add_listener(channel, self._on_notification)
+        except BaseException:
+            await conn.invalidate()
+            await conn.close()
+            raise
+
+        self._conn, self._driver_connection = conn, driver_connection
+
+    async def _close(self):
+        conn, driver_connection = self._conn, self._driver_connection
+        self._conn, self._driver_connection = None, None
+        if conn is None:
+            return
+
+        try:
+            driver_connection.remove_termination_listener(self._on_termination)
+            for channel in self.channels:
+                await driver_connection.remove_listener(channel, self._on_notification)
+            await conn.close()
+        except Exception:
+            # Соединение уже разорвано: в пул оно не возвращается
+            await conn.invalidate()
+            await conn.close()
+
+    async def _watch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._terminated.wait(), LISTENER_CHECK_INTERVAL)
+                logger.warning("Соединение LISTEN закрыто, переподключение")
+            except asyncio.TimeoutError:
+                try:
+                    await asyncio.wait_for(self._driver_connection.fetchval("SELECT 1"), LISTENER_CHECK_INTERVAL)
+                    continue
+                except Exception:
+                    logger.warning("Соединение LISTEN не отвечает, переподключение", exc_info=True)
+
+            await self._close()
+
+            delay = LISTENER_RETRY_MIN
+            while self._conn is None:
+                try:
+                    await self._connect()
+                except Exception:
+                    logger.warning(f"Не удалось переподключить LISTEN, повтор через {delay} с", exc_info=True)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, LISTENER_RETRY_MAX)
+
+            self.reconnects += 1
+            if self.on_reconnect is not None:
+                self.on_reconnect()
@@ -0,0 +1,362 @@
+"""
+Профилирование запросов в работающем приложении (включается через /admin/profiling/settings без перезапуска).
+
+Для выбранных запросов (доля sample_rate или дольше slow_threshold_ms) записывается:
+    - время по фазам: auth, db, endpoint, serialization, total
+    - стеки потока event loop, снятые фоновым потоком раз в interval_ms
+
+Все запросы процесса выполняются в одном потоке event loop, поэтому в профиль запроса попадают
+только стеки, в которых есть кадр корутины его asyncio-задачи (запомненный в Profiler.begin):
+пока поток занят параллельным запросом, стеки этого запроса не пишутся.
+Код, выполняемый запросом в дочерних задачах (например, отправка StreamingResponse), в профиль не попадает.
+
+Профили скачиваются в формате speedscope (https://www.speedscope.app) или pstats.
+
+Настройки рассылаются всем процессам приложения через NOTIFY (SETTINGS_CHANNEL), а профили хранятся
+в памяти снявшего их процесса: id профиля начинается с pid процесса, и скачать профиль можно только
+запросом, попавшим в тот же процесс. Процесс, запущенный после изменения настроек, начинает с выключенным
+профилированием
+"""
+import asyncio
+import functools
+import itertools
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque, Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from source.notify import NotifyListener
+
+
+SETTINGS_CHANNEL = "profiling_settings"
+
+
+class ProfilingSettings(BaseModel):
+    enabled: bool = False
+    sample_rate: float = Field(0.0, ge=0.0, le=1.0)
+    slow_threshold_ms: float | None = Field(None, ge=0)
+    interval_ms: float = Field(5.0, gt=0)
+    max_profiles: int = Field(100, gt=0)
+
+
+class RequestProfile:
+    _ids = itertools.count(1)
+
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.pid = os.getpid()
+        self.id = f"{self.pid}-{next(self._ids)}"
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.status_code = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.phases = Counter()
+        self.stacks = []  # Стеки от корня к листу: tuple[(имя функции, файл, первая строка функции), ...]
+        self.endpoint_finished_at = None
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] += seconds
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "pid": self.pid,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "sampled": self.sampled,
+            "phases_ms": {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            "samples": len(self.stacks),
+        }
+
+
+current_profile: ContextVar[RequestProfile | None] = ContextVar("current_profile", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Добавляет время блока к фазе name текущего профилируемого запроса
+    """
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - start)
+
+
+class Profiler:
+    def __init__(self):
+        self.settings = ProfilingSettings()
+        self.profiles = deque(maxlen=self.settings.max_profiles)
+        self._active = {}  # id профиля -> (профиль, id потока event loop, кадр корутины задачи запроса)
+        self._sampler = None
+        self._lock = threading.Lock()
+        self._listener = NotifyListener({SETTINGS_CHANNEL: self._on_settings})
+
+    def configure(self, settings: ProfilingSettings):
+        self.settings = settings
+        if self.profiles.maxlen != settings.max_profiles:
+            self.profiles = deque(self.profiles, maxlen=settings.max_profiles)
+
+        if settings.enabled and (self._sampler is None or not self._sampler.is_alive()):
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+
+    async def broadcast(self, db: AsyncSession, settings: ProfilingSettings):
+        """
+        Применяет настройки в текущем процессе и отправляет их остальным (NOTIFY уходит при коммите db)
+        """
+        self.configure(settings)
+        await db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": SETTINGS_CHANNEL, "payload": settings.model_dump_json()})
+
+    def _on_settings(self, payload: str):
+        self.configure(ProfilingSettings.model_validate_json(payload))
+
+    async def start_listener(self, engine: AsyncEngine):
+        await self._listener.start(engine)
+
+    async def stop_listener(self):
+        await self._listener.stop()
+
+    def should_profile(self):
+        """
+        None - запрос не профилируется, иначе попал ли он в выборку sample_rate
+        """
+        settings = self.settings
+        if not settings.enabled:
+            return None
+
+        sampled = random.random() < settings.sample_rate
+        if sampled or settings.slow_threshold_ms is not None:
+            return sampled
+        return None
+
+    def begin(self, profile: RequestProfile):
+        task = asyncio.current_task()
+        root_frame = task.get_coro().cr_frame if task is not None else None
+
+        with self._lock:
+            self._active[profile.id] = (profile, threading.get_ident(), root_frame)
+
+    def end(self, profile: RequestProfile):
+        with self._lock:
+            self._active.pop(profile.id, None)
+
+        total = time.perf_counter() - profile.start
+        profile.add_phase("total", total)
+
+        threshold = self.settings.slow_threshold_ms
+        if profile.sampled or (threshold is not None and total * 1000 >= threshold):
+            self.profiles.append(profile)
+
+    def get(self, profile_id: str):
+        for profile in self.profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def _sample_loop(self):
+        while self.settings.enabled:
+            time.sleep(self.settings.interval_ms / 1000)
+
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+
+            frames = sys._current_frames()
+            stacks = {}
+            for profile, thread_id, root_frame in active:
+                if thread_id not in stacks:
+                    stacks[thread_id] = self._stack(frames.get(thread_id))
+                stack, stack_frames = stacks[thread_id]
+                # Поток занят другим запросом или самим event loop - стек не относится к этому запросу
+                if stack and (root_frame is None or id(root_frame) in stack_frames):
+                    profile.stacks.append(stack)
+
+    @staticmethod
+    def _stack(frame, max_depth: int = 128):
+        """
+        (стек от внешнего вызова к внутреннему, id всех кадров стека)
+        """
+        stack, stack_frames = [], set()
+        while frame is not None:
+            # Кадры глубже max_depth в стек не пишутся, но учитываются: кадр корутины задачи - самый внешний
+            if len(stack) < max_depth:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            stack_frames.add(id(frame))
+            frame = frame.f_back
+        return tuple(reversed(stack)), stack_frames
+
+
+profiler = Profiler()
+
+
+def to_speedscope(profile: RequestProfile, interval_ms: float):
+    frames, frame_index, samples = [], {}, []
+
+    for stack in profile.stacks:
+        sample = []
+        for name, file, line in stack:
+            key = (name, file)
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({"name": name, "file": file, "line": line})
+            sample.append(frame_index[key])
+        samples.append(sample)
+
+    name = f"{profile.method} {profile.path} #{profile.id}"
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "todo-list-api",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": interval_ms * len(samples),
+            "samples": samples,
+            "weights": [interval_ms] * len(samples),
+        }],
+    }
+
+
+def to_pstats(profile: RequestProfile, interval_ms: float):
+    """
+    Данные для pstats.Stats (marshal словаря, как у cProfile): время оценивается
+    количеством стеков, в которых функция была листом (tt) или встречалась (ct)
+    """
+    interval = interval_ms / 1000
+    stats = {}
+
+    def entry(func):
+        return stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+
+    for stack in profile.stacks:
+        funcs = [(file, line, name) for name, file, line in stack]
+        seen = set()
+        for i, func in enumerate(funcs):
+            func_stats = entry(func)
+            if func not in seen:
+                seen.add(func)
+                func_stats[0] += 1
+                func_stats[1] += 1
+                func_stats[3] += interval
+            if i:
+                caller = func_stats[4].setdefault(funcs[i - 1], [0, 0, 0.0, 0.0])
+                caller[0] += 1
+                caller[1] += 1
+                caller[3] += interval
+        if funcs:
+            entry(funcs[-1])[2] += interval
+
+    return marshal.dumps({
+        func: (cc, nc, tt, ct, {caller: tuple(values) for caller, values in callers.items()})
+        for func, (cc, nc, tt, ct, callers) in stats.items()
+    })
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: без включённого профилирования только проверяет флаг
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        sampled = profiler.should_profile() if scope["type"] == "http" else None
+        if sampled is None or scope["path"].startswith("/admin/profiling"):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], sampled)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+            await send(message)
+
+        token = current_profile.set(profile)
+        profiler.begin(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.end(profile)
+            current_profile.reset(token)
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Замеряет фазы endpoint (сам обработчик) и serialization (от возврата обработчика
+    до готового ответа: валидация response_model и JSON)
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            original_endpoint = endpoint
+
+            @functools.wraps(original_endpoint)
+            async def endpoint(*args, **endpoint_kwargs):
+                profile = current_profile.get()
+                if profile is None:
+                    return await original_endpoint(*args, **endpoint_kwargs)
+
+                start = time.perf_counter()
+                try:
+                    return await original_endpoint(*args, **endpoint_kwargs)
+                finally:
+                    profile.endpoint_finished_at = time.perf_counter()
+                    profile.add_phase("endpoint", profile.endpoint_finished_at - start)
+
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+
+        async def profiled_route_handler(request):
+            response = await route_handler(request)
+
+            profile = current_profile.get()
+            if profile is not None and profile.endpoint_finished_at is not None:
+                profile.add_phase("serialization", time.perf_counter() - profile.endpoint_finished_at)
+            return response
+
+        return profiled_route_handler
+
+
+def install_db_timing(engine):
+    """
+    Фаза db: время выполнения SQL-запросов (по событиям SQLAlchemy)
+    """
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None:
+            conn.info.setdefault("profiling_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = current_profile.get()
+        starts = conn.info.get("profiling_query_start")
+        if profile is not None and starts:
+            profile.add_phase("db", time.perf_counter() - starts.pop())
@@ -1,4 +1,6 @@
 from pydantic import BaseModel, ConfigDict
+from typing import Any, Literal
+from datetime import datetime
 
 
 class TaskPermission(BaseModel):
@@ -16,19 +18,37 @@ class TaskBase(BaseModel):
 
 class TaskCreate(TaskBase):
     owner_id: int
+    parent_id: int | None = None
 
 
 class Task(TaskBase):
     id: int
     owner_id: int
+    parent_id: int | None = None
+    # True - в description только начало описания, полностью оно в /tasks/read/{id}
+    description_truncated: bool = False
     model_config = ConfigDict(from_attributes=True)
 
 
+class TaskTreeNode(Task):
+    depth: int
+
+
+class TaskMove(BaseModel):
+    parent_id: int | None = None
+
+
 class ReadTaskParams(BaseModel):
     skip: int = 0
     limit: int = 10
 
 
+class TaskSummary(BaseModel):
+    owned: int
+    shared: int
+    total: int
+
+
 class Token(BaseModel):
     access_token: str
     expire_minutes: int
@@ -61,3 +81,50 @@ class TaskPermissionUpdate(BaseModel):
     user_id: int
     can_read: bool | None = None
     can_update: bool | None = None
+
+
+class BatchOperation(BaseModel):
+    op: Literal["create_task", "update_permissions", "read_task", "read_tasks", "update_task", "delete_task",
+                "move_task"]
+    task_id: int | None = None
+    body: dict | None = None
+
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation]
+    atomic: bool = False
+
+
+class BatchOperationResult(BaseModel):
+    status_code: int
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    committed: bool
+    results: list[BatchOperationResult]
+
+
+class BulkShare(BaseModel):
+    task_ids: list[int]
+    user_ids: list[int]
+    can_read: bool | None = True
+    can_update: bool | None = None
+
+
+class TaskImport(BaseModel):
+    tasks: list[TaskBase]
+
+
+class Job(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress: int
+    total: int | None
+    result: dict | None
+    error: str | None
+    cancel_requested: bool
+    created_at: datetime
+    updated_at: datetime
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,55 @@
+"""
+Запуск API в проде:
+    python -m source.server --workers 4 --host 0.0.0.0 --port 8000
+
+При SIGTERM/SIGINT uvicorn перестаёт принимать новые соединения, ждёт завершения
+текущих запросов (не дольше --timeout-graceful-shutdown), после чего в lifespan
+закрываются пулы соединений с БД.
+"""
+import argparse
+import os
+import uvicorn
+from secret_data import config
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(prog="python -m source.server", description="Запуск ToDo List API")
+    parser.add_argument("--host", default=getattr(config, "SERVER_HOST", "127.0.0.35"))
+    parser.add_argument("--port", type=int, default=getattr(config, "SERVER_PORT", 8000))
+    parser.add_argument("--workers", type=int, default=getattr(config, "SERVER_WORKERS", os.cpu_count() or 1),
+                        help="Количество процессов (по умолчанию - по числу ядер)")
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default="auto",
+                        help="auto - uvloop, если установлен")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default="auto",
+                        help="auto - httptools, если установлен")
+    parser.add_argument("--backlog", type=int, default=2048,
+                        help="Максимальная очередь ещё не принятых соединений")
+    parser.add_argument("--timeout-keep-alive", type=int, default=5,
+                        help="Сколько секунд держать простаивающее keep-alive соединение")
+    parser.add_argument("--timeout-graceful-shutdown", type=int, default=30,
+                        help="Сколько секунд ждать завершения текущих запросов при остановке")
+    parser.add_argument("--limit-concurrency", type=int, default=None,
+                        help="Максимум одновременных соединений на процесс, сверх него - 503")
+    return parser.parse_args(args)
+
+
+def run(args=None):
+    args = parse_args(args)
+
+    uvicorn.run(
+        "source.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.timeout_keep_alive,
+        timeout_graceful_shutdown=args.timeout_graceful_shutdown,
+        limit_concurrency=args.limit_concurrency,
+        lifespan="on",
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -8,16 +8,24 @@ sys.path.append(os.getcwd())
 import pytest
 from httpx import AsyncClient, ASGITransport
 from source.main import app
+from source.clients.todo_client import AsyncTodoClient, ApiError
+from source import jobs
 from secret_data import config
 
 config.DB_NAME = "pytest_todo_app"
 config.DB_USERNAME = "pytestuser1"
 config.DB_PASSWORD = "123456"
 
-from source.database import create_all_tables, drop_all_tables, get_db
+from source.database import create_all_tables, drop_all_tables, get_db, engine
+from source import migrations
+from source.cache import task_cache, TTLCache
 from source.models import models
+from source.crud import user_visible_tasks, task_counters, task_bodies, user_tasks
+from source.schemas import schemas
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import update, inspect, text
+from sqlalchemy.dialects import postgresql
 import pytest_asyncio
 import asyncio
 import warnings
@@ -49,6 +57,8 @@ def event_loop():
 async def create_tables():
     # print("Creating all tables")
     await create_all_tables()
+    # id задач после пересоздания таблиц начинаются заново, поэтому кэш от прошлых тестов сбрасывается
+    task_cache.local.clear()
     yield
     # print("Dropping all tables")
     await drop_all_tables()
@@ -366,6 +376,23 @@ async def test_delete_task(client, db: AsyncSession):
     owner_task_json = await create_task(client, owner_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION, owner_json["id"])
     # print(owner_task_json)
 
+    user_json = await create_user(client, "testuser2", "testpass")
+
+    response_json = await get_auth_token(client, "testuser2", "testpass")
+
+    user_token = response_json['access_token']
+
+    response = await client.post(f"/tasks/delete/{owner_task_json['id']}?token={user_token}")
+
+    assert response.status_code == 403
+
+    # Право на изменение не даёт права удалить чужую корневую задачу
+    await update_task_permissions(client, owner_token, user_json["id"], owner_task_json["id"], can_update=True)
+
+    response = await client.post(f"/tasks/delete/{owner_task_json['id']}?token={user_token}")
+
+    assert response.status_code == 403
+
     response = await client.post(f"/tasks/delete/{owner_task_json['id']}?token={owner_token}")
 
     update_task_json = response.json()
@@ -374,6 +401,669 @@ async def test_delete_task(client, db: AsyncSession):
     assert response.status_code == 200
     assert update_task_json["status"] == "success"
 
+    # Права на удалённую задачу удаляются вместе с ней
+    response = await client.post(f"/users/check_token_auth?token={user_token}")
+
+    assert response.status_code == 200
+    assert response.json()["permissions"] == []
+
     response = await client.post(f"/tasks/delete/{123456}?token={owner_token}")
 
     assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_todo_client(db: AsyncSession):
+    async with AsyncTodoClient("http://test", TEST_USERNAME, TEST_PASSWORD,
+                               transport=ASGITransport(app=app)) as todo_client:
+        user = await todo_client.create_user()
+
+        assert user.username == TEST_USERNAME
+
+        tasks = await todo_client.bulk_create_tasks(
+            [schemas.TaskBase(title=TEST_TASK_TITLE, description=TEST_TASK_DESCRIPTION) for _ in range(5)]
+        )
+
+        assert all(task.owner_id == user.id for task in tasks)
+
+        task_ids = [task.id async for task in todo_client.iter_tasks(page_size=2)]
+
+        assert sorted(task_ids) == sorted(task.id for task in tasks)
+
+        await todo_client.delete_task(tasks[0].id)
+
+        with pytest.raises(ApiError) as exc_info:
+            await todo_client.delete_task(tasks[0].id)
+
+        assert exc_info.value.status_code == 404
+
+        # Отклонённый токен заменяется новым один раз, 403 с новым токеном - нехватка прав
+        todo_client._token = "some.random.token"
+
+        assert (await todo_client.read_task(tasks[1].id)).id == tasks[1].id
+
+    async with AsyncTodoClient("http://test", "testuser2", "testpass",
+                               transport=ASGITransport(app=app)) as other_client:
+        await other_client.create_user()
+        get_token = other_client.get_token
+        token_requests = []
+
+        async def counting_get_token():
+            token_requests.append(None)
+            return await get_token()
+
+        other_client.get_token = counting_get_token
+
+        for _ in range(3):
+            with pytest.raises(ApiError) as exc_info:
+                await other_client.read_task(tasks[1].id)
+
+            assert exc_info.value.status_code == 403
+
+        assert len(token_requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_batch(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    user_json = await create_user(client, "testuser2", "testpass")
+
+    json_data = {
+        "operations": [
+            {"op": "create_task", "body": {"title": TEST_TASK_TITLE, "description": TEST_TASK_DESCRIPTION,
+                                           "owner_id": owner_json["id"]}},
+            {"op": "read_tasks", "body": {"skip": 0, "limit": 10}},
+            {"op": "read_task", "task_id": 123456},
+        ]
+    }
+
+    response = await client.post(f"/batch?token={owner_token}", json=json_data)
+
+    batch_json = response.json()
+    # print(batch_json)
+
+    assert response.status_code == 200
+    assert batch_json["committed"]
+    assert [result["status_code"] for result in batch_json["results"]] == [200, 200, 403]
+
+    task_id = batch_json["results"][0]["body"]["id"]
+
+    assert [task["id"] for task in batch_json["results"][1]["body"]] == [task_id]
+
+    json_data = {
+        "atomic": True,
+        "operations": [
+            {"op": "update_permissions", "task_id": task_id, "body": {"user_id": user_json["id"], "can_read": True}},
+            {"op": "update_task", "task_id": 123456, "body": {"title": "New task title",
+                                                              "description": TEST_TASK_DESCRIPTION}},
+            {"op": "delete_task", "task_id": task_id},
+        ]
+    }
+
+    response = await client.post(f"/batch?token={owner_token}", json=json_data)
+
+    batch_json = response.json()
+
+    assert response.status_code == 200
+    assert not batch_json["committed"]
+    assert [result["status_code"] for result in batch_json["results"]] == [200, 403, 424]
+
+    response_json = await get_auth_token(client, "testuser2", "testpass")
+
+    await read_task(client, response_json['access_token'], task_id, 403)
+
+
+@pytest.mark.asyncio
+async def test_health(client):
+    response = await client.get("/health/live")
+
+    assert response.status_code == 200
+
+    response = await client.get("/health/ready")
+
+    response_json = response.json()
+
+    assert response.status_code == 200
+    assert response_json["status"] == "ok"
+    assert "checked_out" in response_json["pool"]
+
+
+@pytest.mark.asyncio
+async def test_read_task_cache(client, db: AsyncSession, monkeypatch):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    task_json = await create_task(client, owner_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION, owner_json["id"])
+
+    hits = (await client.get("/metrics/task_cache")).json()["hits"]
+
+    await read_task(client, owner_token, task_json["id"])
+    await read_task(client, owner_token, task_json["id"])
+
+    response_json = (await client.get("/metrics/task_cache")).json()
+
+    assert response_json["hits"] == hits + 1
+
+    json_data = {
+        "title": "New task title",
+        "description": TEST_TASK_DESCRIPTION,
+    }
+
+    await client.post(f"/tasks/update/{task_json['id']}?token={owner_token}", json=json_data)
+
+    read_task_json = await read_task(client, owner_token, task_json["id"])
+
+    assert read_task_json["title"] == "New task title"
+
+    # Инвалидация во время чтения из БД: прочитанная запись в кэш не попадает
+    task_cache.local.clear()
+    generation = task_cache.generation
+    await task_cache.invalidate(task_json["id"])
+
+    assert not await task_cache.set(task_json["id"], {"task": {}, "permissions": {}}, generation)
+    assert task_cache.local.get(task_json["id"]) is None
+
+    # Запись, заново заполненная параллельным запросом старой строкой, не должна попадать в /batch
+    # после его собственного изменения задачи
+    stale_entry = await user_tasks.get_task_cache_entry(db, task_json["id"])
+
+    async def get_stale_entry(task_id):
+        return stale_entry
+
+    monkeypatch.setattr(task_cache, "get", get_stale_entry)
+
+    json_data = {
+        "operations": [
+            {"op": "update_task", "task_id": task_json["id"], "body": {"title": "Batch title",
+                                                                       "description": TEST_TASK_DESCRIPTION}},
+            {"op": "read_task", "task_id": task_json["id"]},
+        ]
+    }
+
+    response = await client.post(f"/batch?token={owner_token}", json=json_data)
+
+    assert response.json()["results"][1]["body"]["title"] == "Batch title"
+
+
+def test_task_cache_max_bytes():
+    cache = TTLCache(maxsize=10, ttl=60, maxbytes=100)
+
+    cache.set(1, "a", 60)
+    cache.set(2, "b", 60)
+
+    assert cache.get(1) is None
+    assert cache.get(2) == "b"
+    assert cache.bytes == 60
+
+    cache.set(2, "c", 30)
+    cache.delete(2)
+
+    assert cache.bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_user_visible_tasks_consistency(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    user_json = await create_user(client, "testuser2", "testpass")
+
+    task_ids = []
+    for i in range(3):
+        task_json = await create_task(client, owner_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION, owner_json["id"])
+        task_ids.append(task_json["id"])
+
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[0], can_read=True)
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[1], can_read=True, can_update=True)
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[1], can_read=False)
+
+    await client.post(f"/tasks/delete/{task_ids[2]}?token={owner_token}")
+
+    assert await user_visible_tasks.count_visible_tasks(db, owner_json["id"]) == 2
+    assert await user_visible_tasks.count_visible_tasks(db, user_json["id"]) == 1
+
+    report = await user_visible_tasks.check_consistency(db)
+
+    assert report["missing"]["count"] == 0
+    assert report["extra"]["count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_tasks_summary(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    user_json = await create_user(client, "testuser2", "testpass")
+
+    response_json = await get_auth_token(client, "testuser2", "testpass")
+
+    user_token = response_json['access_token']
+
+    task_ids = []
+    for i in range(3):
+        task_json = await create_task(client, owner_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION, owner_json["id"])
+        task_ids.append(task_json["id"])
+
+    await create_task(client, user_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION, user_json["id"])
+
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[0], can_read=True)
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[0], can_update=True)
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[1], can_read=True)
+
+    await client.post(f"/tasks/delete/{task_ids[1]}?token={owner_token}")
+
+    response = await client.post(f"/tasks/summary?token={owner_token}")
+
+    assert response.status_code == 200
+    assert response.json() == {"owned": 2, "shared": 0, "total": 2}
+
+    response = await client.post(f"/tasks/summary?token={user_token}")
+
+    assert response.status_code == 200
+    assert response.json() == {"owned": 1, "shared": 1, "total": 2}
+
+    response = await client.post(f"/tasks/summary?token={owner_token}x")
+
+    assert response.status_code == 403
+
+    report = await task_counters.check_consistency(db)
+
+    assert report["count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_profiling(client, monkeypatch):
+    monkeypatch.setattr(config, "ADMIN_TOKEN", "test admin token", raising=False)
+    admin_headers = {"X-Admin-Token": config.ADMIN_TOKEN}
+
+    response = await client.post("/admin/profiling/settings", json={"enabled": True, "sample_rate": 1.0},
+                                 headers={"X-Admin-Token": "wrong token"})
+
+    assert response.status_code == 403
+
+    response = await client.post("/admin/profiling/settings", json={"enabled": True, "sample_rate": 1.0},
+                                 headers=admin_headers)
+
+    assert response.status_code == 200
+
+    await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+    await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    await client.post("/admin/profiling/settings", json={"enabled": False}, headers=admin_headers)
+
+    response = await client.get("/admin/profiling/profiles", headers=admin_headers)
+
+    profiles_json = response.json()
+
+    assert response.status_code == 200
+    assert profiles_json[0]["path"] == "/users/get_token"
+    assert profiles_json[0]["pid"] == int(response.headers["X-Worker-Pid"])
+    assert profiles_json[0]["id"].startswith(f"{profiles_json[0]['pid']}-")
+    assert {"auth", "db", "endpoint", "serialization", "total"} <= set(profiles_json[0]["phases_ms"])
+
+    response = await client.get(f"/admin/profiling/profiles/{profiles_json[0]['id']}", headers=admin_headers)
+
+    assert response.status_code == 200
+    assert response.json()["profiles"][0]["type"] == "sampled"
+
+
+async def read_job(client, token: str, job_id: int):
+    response = await client.post(f"/jobs/{job_id}?token={token}")
+
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_jobs(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    user_json = await create_user(client, "testuser2", "testpass")
+
+    response_json = await get_auth_token(client, "testuser2", "testpass")
+
+    user_token = response_json['access_token']
+
+    json_data = {"tasks": [{"title": TEST_TASK_TITLE, "description": TEST_TASK_DESCRIPTION} for _ in range(5)]}
+
+    response = await client.post(f"/tasks/import?token={owner_token}", json=json_data)
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+
+    assert await jobs.job_runner.run_once()
+
+    job_json = await read_job(client, owner_token, response.json()["id"])
+
+    assert job_json["status"] == "succeeded"
+    assert job_json["progress"] == job_json["total"] == 5
+
+    first_task_id = job_json["result"]["first_task_id"]
+    json_data = {"task_ids": [first_task_id, first_task_id + 1], "user_ids": [user_json["id"]], "can_read": True}
+
+    response = await client.post(f"/tasks/bulk_share?token={owner_token}", json=json_data)
+
+    assert await jobs.job_runner.run_once()
+
+    job_json = await read_job(client, owner_token, response.json()["id"])
+
+    assert job_json["status"] == "succeeded"
+    assert job_json["result"]["shared"] == 2
+
+    await read_task(client, user_token, first_task_id + 1)
+
+    response = await client.post(f"/jobs/{job_json['id']}?token={user_token}")
+
+    assert response.status_code == 404
+
+    response = await client.post(f"/tasks/export?token={owner_token}")
+
+    assert await jobs.job_runner.run_once()
+
+    job_json = await read_job(client, owner_token, response.json()["id"])
+
+    assert job_json["status"] == "succeeded"
+    assert job_json["progress"] == job_json["total"] == 5
+    assert [task["id"] for task in job_json["result"]["tasks"]] == list(range(first_task_id, first_task_id + 5))
+    assert schemas.TaskImport.model_validate(job_json["result"]).tasks[0].description == TEST_TASK_DESCRIPTION
+
+    response = await client.post(f"/tasks/purge?token={owner_token}")
+
+    response = await client.post(f"/jobs/{response.json()['id']}/cancel?token={owner_token}")
+
+    assert response.json()["status"] == "cancelled"
+    assert not await jobs.job_runner.run_once()
+
+
+@pytest.mark.asyncio
+async def test_import_job_resume(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    json_data = {"tasks": [{"title": TEST_TASK_TITLE, "description": f"{i}"} for i in range(3)]}
+
+    response = await client.post(f"/tasks/import?token={owner_token}", json=json_data)
+    job_id = response.json()["id"]
+
+    # Предыдущая попытка успела закоммитить две задачи и была прервана
+    await db.execute(update(models.Job).filter(models.Job.id == job_id).values(
+        progress=2, result={"created": 2, "first_task_id": 1000}
+    ))
+    await db.commit()
+
+    assert await jobs.job_runner.run_once()
+
+    job_json = await read_job(client, owner_token, job_id)
+
+    assert job_json["status"] == "succeeded"
+    assert job_json["result"] == {"created": 3, "first_task_id": 1000}
+
+    result = await db.execute(select(models.Task.description).filter(models.Task.owner_id == owner_json["id"]))
+
+    assert list(result.scalars()) == ["2"]
+
+
+@pytest.mark.asyncio
+async def test_subtasks(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    user_json = await create_user(client, "testuser2", "testpass")
+
+    response_json = await get_auth_token(client, "testuser2", "testpass")
+
+    user_token = response_json['access_token']
+
+    root_json = await create_task(client, owner_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION, owner_json["id"])
+    other_root_json = await create_task(client, owner_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION, owner_json["id"])
+
+    task_ids = [root_json["id"]]
+    for i in range(2):
+        json_data = {
+            "title": TEST_TASK_TITLE,
+            "description": TEST_TASK_DESCRIPTION,
+            "owner_id": owner_json["id"],
+            "parent_id": task_ids[-1],
+        }
+        response = await client.post(f"/tasks/create?token={owner_token}", json=json_data)
+
+        assert response.status_code == 200
+        assert response.json()["parent_id"] == task_ids[-1]
+        task_ids.append(response.json()["id"])
+
+    response = await client.post(f"/tasks/read/{task_ids[2]}?token={user_token}")
+
+    assert response.status_code == 403
+
+    # Права выдаются только на корневую задачу и наследуются подзадачами
+    response = await client.post(f"/tasks/update_permissions/{task_ids[1]}?token={owner_token}",
+                                 json={"user_id": user_json["id"], "can_read": True})
+
+    assert response.status_code == 400
+
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[0], can_read=True)
+
+    response = await client.post(f"/tasks/read/{task_ids[2]}?token={user_token}")
+
+    assert response.status_code == 200
+
+    response = await client.post(f"/tasks/tree/{task_ids[0]}?token={user_token}")
+
+    assert response.status_code == 200
+    assert [(node["id"], node["depth"]) for node in response.json()] == list(zip(task_ids, range(3)))
+
+    response = await client.post(f"/tasks/read_tasks?token={user_token}")
+
+    assert [task["id"] for task in response.json()] == [task_ids[0]]
+
+    response = await client.post(f"/tasks/move/{task_ids[0]}?token={owner_token}", json={"parent_id": task_ids[2]})
+
+    assert response.status_code == 400
+
+    response = await client.post(f"/tasks/move/{task_ids[1]}?token={owner_token}",
+                                 json={"parent_id": other_root_json["id"]})
+
+    assert response.status_code == 200
+
+    # Перенесённое поддерево теперь наследует права другой корневой задачи
+    response = await client.post(f"/tasks/read/{task_ids[2]}?token={user_token}")
+
+    assert response.status_code == 403
+
+    response = await client.post(f"/tasks/tree/{other_root_json['id']}?token={owner_token}")
+
+    assert [node["id"] for node in response.json()] == [other_root_json["id"]] + task_ids[1:]
+
+    response = await client.post(f"/tasks/delete/{other_root_json['id']}?token={owner_token}")
+
+    assert response.status_code == 200
+
+    response = await client.post(f"/tasks/read/{task_ids[2]}?token={owner_token}")
+
+    assert response.status_code == 403
+
+    report = await user_visible_tasks.check_consistency(db)
+
+    assert report["missing"]["count"] == 0
+    assert report["extra"]["count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_long_description(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    # Несколько частей task_bodies и символы, занимающие в UTF-8 больше одного байта
+    description = "".join(f"Строка {i}\n" for i in range(20_000))
+    raw = description.encode()
+
+    task_json = await create_task(client, owner_token, TEST_TASK_TITLE, description, owner_json["id"])
+
+    assert task_json["description_truncated"]
+    assert task_json["description"] == description[:task_bodies.DESCRIPTION_PREVIEW_LENGTH]
+
+    response = await client.post(f"/tasks/read_tasks?token={owner_token}")
+
+    assert response.json()[0]["description"] == description[:task_bodies.DESCRIPTION_PREVIEW_LENGTH]
+
+    response = await client.post(f"/tasks/read/{task_json['id']}?token={owner_token}")
+
+    assert response.json()["description"] == description
+    assert not response.json()["description_truncated"]
+
+    offset, length = task_bodies.BODY_CHUNK_SIZE - 10, task_bodies.BODY_CHUNK_SIZE + 20
+    response = await client.post(f"/tasks/read_description/{task_json['id']}?token={owner_token}"
+                                 f"&offset={offset}&length={length}")
+
+    assert response.status_code == 200
+    assert response.content == raw[offset:offset + length]
+    assert response.headers["X-Description-Size"] == str(len(raw))
+
+    response = await client.post(f"/tasks/update/{task_json['id']}?token={owner_token}",
+                                 json={"title": TEST_TASK_TITLE, "description": TEST_TASK_DESCRIPTION})
+
+    assert not response.json()["description_truncated"]
+
+    response = await client.post(f"/tasks/read_description/{task_json['id']}?token={owner_token}")
+
+    assert response.text == TEST_TASK_DESCRIPTION
+    assert await task_bodies.get_body_size(db, task_json["id"]) == 0
+
+
+@pytest.mark.asyncio
+async def test_list_etags_and_compression(client, db: AsyncSession):
+    owner_json = await create_user(client, TEST_USERNAME, TEST_PASSWORD)
+
+    response_json = await get_auth_token(client, TEST_USERNAME, TEST_PASSWORD)
+
+    owner_token = response_json['access_token']
+
+    user_json = await create_user(client, "testuser2", "testpass")
+
+    response_json = await get_auth_token(client, "testuser2", "testpass")
+
+    user_token = response_json['access_token']
+
+    task_ids = []
+    for i in range(10):
+        task_json = await create_task(client, owner_token, TEST_TASK_TITLE, TEST_TASK_DESCRIPTION * 20, owner_json["id"])
+        task_ids.append(task_json["id"])
+
+    response = await client.post(f"/tasks/read_tasks?token={owner_token}", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(response.json()) == 10
+    etag = response.headers["ETag"]
+
+    response = await client.post(f"/tasks/read_tasks?token={owner_token}", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # Другая страница - другой ETag
+    response = await client.post(f"/tasks/read_tasks?token={owner_token}", json={"skip": 5, "limit": 10},
+                                 headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert len(response.json()) == 5
+
+    response = await client.post(f"/users/check_token_auth?token={user_token}")
+    user_etag = response.headers["ETag"]
+
+    await update_task_permissions(client, owner_token, user_json["id"], task_ids[0], can_read=True)
+
+    response = await client.post(f"/users/check_token_auth?token={user_token}", headers={"If-None-Match": user_etag})
+
+    assert response.status_code == 200
+    assert len(response.json()["permissions"]) == 1
+
+    response = await client.post(f"/users/check_token_auth?token={user_token}",
+                                 headers={"If-None-Match": response.headers["ETag"]})
+
+    assert response.status_code == 304
+
+    # Изменение задачи меняет списки всех, кому она видна
+    response = await client.post(f"/tasks/read_tasks?token={user_token}")
+    user_etag = response.headers["ETag"]
+
+    await client.post(f"/tasks/update/{task_ids[0]}?token={owner_token}",
+                      json={"title": TEST_TASK_TITLE, "description": "new description"})
+
+    for token, old_etag in ((owner_token, etag), (user_token, user_etag)):
+        response = await client.post(f"/tasks/read_tasks?token={token}", headers={"If-None-Match": old_etag})
+
+        assert response.status_code == 200
+
+    response = await client.post(f"/tasks/read_tasks?token={user_token}", headers={"If-None-Match": user_etag})
+
+    assert response.json()[0]["description"] == "new description"
+
+    response = await client.post("/tasks/read_tasks?token=bad token", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 403
+
+
+def describe_schema(sync_conn):
+    """
+    {таблица: (столбцы {имя: (тип, nullable)}, имена индексов и уникальных ограничений)} для таблиц моделей
+    """
+    inspector = inspect(sync_conn)
+    schema = {}
+    for table in models.Base.metadata.tables:
+        columns = {column["name"]: (column["type"].compile(dialect=postgresql.dialect()), column["nullable"])
+                   for column in inspector.get_columns(table)}
+        indexes = {index["name"] for index in inspector.get_indexes(table) if not index.get("duplicates_constraint")}
+        indexes |= {constraint["name"] for constraint in inspector.get_unique_constraints(table)}
+        schema[table] = (columns, indexes)
+    return schema
+
+
+@pytest.mark.asyncio
+async def test_migrations_from_empty_database():
+    async with engine.begin() as conn:
+        expected = await conn.run_sync(describe_schema)
+
+    await drop_all_tables()
+    try:
+        revision = await migrations.upgrade(engine, log=lambda message: None)
+
+        assert revision == migrations.HEAD_REVISION
+
+        async with engine.begin() as conn:
+            assert await conn.run_sync(describe_schema) == expected
+
+        await migrations.check_schema_revision(engine)
+    finally:
+        await drop_all_tables()
+        async with engine.begin() as conn:
+            await conn.execute(text("DROP TABLE IF EXISTS schema_revision"))
+            await conn.execute(text("DROP FUNCTION IF EXISTS user_visible_tasks_fill_owner_id()"))
+        await create_all_tables()